@@ -6,40 +6,22 @@
 #lauch from Streamlit cloud -> my apps
 
 #import modules
-import numpy as np
 import streamlit as st
-import pandas as pd 
-import random
-import string
 import datetime
-import os
-import dropbox
-from io import StringIO
-import requests
-
-app_key = st.secrets["dropbox"]["app_key"]
-app_secret = st.secrets["dropbox"]["app_secret"]
-refresh_token = st.secrets["dropbox"]["refresh_token"]
-
-def get_new_access_token(app_key, app_secret, refresh_token):
-    token_url = "https://api.dropboxapi.com/oauth2/token"
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    auth = (app_key, app_secret)
-
-    response = requests.post(token_url, data=data, auth=auth)
-    response.raise_for_status()
-    tokens = response.json()
-    return tokens["access_token"]
-
-# Initialize Dropbox client
-access_token = get_new_access_token(app_key, app_secret, refresh_token)
-dbx = dropbox.Dropbox(access_token)
+from dropbox_storage import get_storage_mode, get_table_format, start_compactor, start_csv_export
+from submission_queue import draft_row, draft_items, commit_draft, submission_id, submission_seen, show_save_status
+from producer_registry import find_producer_id, new_producer_id, remember_producer, number_draft_fields, FIELD_NUMBER_ERRORS
+#answer options of the forms, shared with the table schemas (survey_schema.py)
+from survey_schema import (
+    YES_NO, NO_YES, SELECT_YES_NO, ED_LEVEL_OPTIONS, FARM_PURPOSE_OPTIONS, QUALITY_OPTIONS,
+    CROP_PURPOSE_OPTIONS, PREV_CROP_PURPOSE_OPTIONS, YIELD_UNIT_OPTIONS, SEED_SOURCE_OPTIONS, SEED_TREAT_OPTIONS,
+    SEED_RATE_UNIT_OPTIONS, TILLAGE_OPTIONS, PROFILE_H20_RANK_OPTIONS, NUTRIENT_PRODUCTS, RATE_UNIT_OPTIONS,
+    APPLICATION_TIME_OPTIONS, APPLIED_WITH_OPTIONS, VARIABLE_RATE_OPTIONS, NUTRIENT_SLOTS, NUTRIENT_OPTIONS,
+    IRR_DECISION_OPTIONS, IRR_TYPE_OPTIONS, WATER_SOURCE_OPTIONS, IRRIGATION_EVENTS, MONTH_OPTIONS, EARLY_LATE_OPTIONS,
+)
 
-# Use dbx here
-files = dbx.files_list_folder('').entries
+#Dropbox client is built lazily (dropbox_storage.get_dbx) the first time data is needed
+#(one pooled client per server process, its token is refreshed in the background)
 
 #___________________________________________________________________________________________________________________________________________
 #___________________________________________________________________________________________________________________________________________
@@ -55,6 +37,13 @@ field_FILE_PATH = "/streamlit/fields_info.csv"
 #folder to save soil test uploads
 soil_tests = "/streamlit/soiltest_uploads"
 
+#fold submission records into a parquet snapshot in the background (records storage mode only)
+if get_storage_mode() == "records":
+    start_compactor((producer_FILE_PATH, field_FILE_PATH))
+#tables kept compressed are copied to their .csv paths in the background for the research team
+elif get_table_format() != "csv":
+    start_csv_export((producer_FILE_PATH, field_FILE_PATH))
+
 #___________________________________________________________________________________________________________________________________________
 #___________________________________________________________________________________________________________________________________________
 
@@ -150,21 +139,14 @@ st.write(css, unsafe_allow_html=True)
 #============================================================================================================================================
 
 #define function to generate unique producer ID (use when submitted)
-def generate_unique_id(df, user_firstname, user_lastname):
+def generate_unique_id(user_firstname, user_lastname, user_email="", user_phone=""):
     """Generate a unique ID or use existing one"""
-    #check for existing same name
-    existing_row = df[(df['firstname'].str.lower() == user_firstname.lower()) & (df['lastname'].str.lower() == user_lastname.lower())]
-
-    #if found use same ID
-    if not existing_row.empty:
-        return existing_row.iloc[0]['producer_id']
-    else:
-        # else generate new ID
-        while True:
-            producer_id = ''.join(random.choices(string.digits, k=6)) 
-            # make sure ID doesn't already exist
-            if producer_id not in df['producer_id'].values:
-                return producer_id 
+    #returning producer with the same email, phone or name keeps their ID (see producer_registry)
+    producer_id = find_producer_id(producer_FILE_PATH, user_firstname, user_lastname, user_email, user_phone)
+    if producer_id is not None:
+        return producer_id
+    # else generate new ID
+    return new_producer_id(producer_FILE_PATH)
 
 #start with no producer ID in session state
 if 'producer_id' not in st.session_state:
@@ -204,30 +186,6 @@ new_data = {
 }
 expected_columns = list(new_data.keys())
 
-#read csv, populate fields if starting empty
-# Helper: Read CSV from Dropbox
-def read_csv_from_dropbox_safely(path, columns):
-    try:
-        metadata, res = dbx.files_download(path)
-        data = res.content.decode("utf-8").strip()  # Strip whitespace and newlines
-        
-        if not data:
-            return pd.DataFrame(columns=columns)
-
-        # Check that the first line contains headers
-        if ',' not in data.splitlines()[0]:
-            return pd.DataFrame(columns=columns)
-
-        df = pd.read_csv(StringIO(data))
-        return df
-    
-    except dropbox.exceptions.ApiError as e:
-        st.warning(f"Dropbox API error or file not found: {e}")
-        return pd.DataFrame(columns=columns)
-    
-    except pd.errors.EmptyDataError:
-        return pd.DataFrame(columns=columns)
-df = read_csv_from_dropbox_safely(producer_FILE_PATH, expected_columns)
 
 #---------------------------------------------------------------------------------------------------------------------------------------------------
 options_form = st.form("options_form", clear_on_submit = False) #create form, clear fields when data is submitted
@@ -256,8 +214,7 @@ with options_form:
 
     left, right = options_form.columns([2,3], vertical_alignment = "bottom")
     new_data['age'] = left.text_input("Age")
-    new_data['ed_level'] = right.selectbox("Highest Level of Completed Education",options = ("--","below highschool",
-                                "highschool","some college","associates degree","trade/vocational program","bachelors degree","postgraduate degree"))
+    new_data['ed_level'] = right.selectbox("Highest Level of Completed Education",options = ED_LEVEL_OPTIONS)
 
     #education source
     st.write('Primary Source of Information (select all that apply):')
@@ -282,7 +239,7 @@ with options_form:
     new_data['rotation_irr'] = options_form.text_input("Typical Irrigated Rotation")
 
     new_data['years_irr'] = options_form.text_input("Year Spent Irrigating Wheat")
-    new_data['dry_v_irr'] = options_form.radio("Also Grow Dryland Wheat?", options=("Select","yes", "no"), horizontal=True)
+    new_data['dry_v_irr'] = options_form.radio("Also Grow Dryland Wheat?", options=SELECT_YES_NO, horizontal=True)
 
     #water limitations
     options_form.markdown("Briefly describe any restrictions faced on water usage?")
@@ -298,7 +255,7 @@ with options_form:
     new_data['limits'] = options_form.text_area("", height = 68)
     
     options_form.markdown("<hr>", unsafe_allow_html=True)
-    new_data['quality'] = options_form.radio("Relative Data Quality", options = ("a","b","c"), horizontal = True)
+    new_data['quality'] = options_form.radio("Relative Data Quality", options = QUALITY_OPTIONS, horizontal = True)
 
     #agreement with the statements
     # options_form.markdown("Rate the following two statements:")
@@ -346,7 +303,7 @@ with options_form:
 
 #define conditional placeholders for 'other' options 
 with farm_purpose:
-    selection2 = st.selectbox("Primary Purpose of Farm", options = ("--","Grain","Livestock","50/50","Other"))
+    selection2 = st.selectbox("Primary Purpose of Farm", options = FARM_PURPOSE_OPTIONS)
 with placeholder_2:
     if selection2 == "Other":
         purpose_other = st.text_input("Enter other purpose")
@@ -354,12 +311,6 @@ with placeholder_2:
 
 #if form 1 submitted:
 if add_data:
-    #use the producer ID function
-    new_data['producer_id'] = generate_unique_id(df, new_data['firstname'], new_data['lastname'])
-
-    #save producer ID into session state to take to the second form
-    st.session_state['producer_id'] = new_data['producer_id']
-
     #fill farm purpose with 'other'
     purpose_temp = ""
     if selection2 == "Other":
@@ -368,15 +319,20 @@ if add_data:
         purpose_temp = selection2
 
     new_data['farm_purpose'] = purpose_temp
- 
-    #add to end of csv
-    new_df = pd.DataFrame([new_data]) #dictionary to data frame
-    df = pd.concat([df, new_df], ignore_index=True) #append to csv
-    
-    # Save updated DataFrame to Dropbox
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    dbx.files_upload(csv_buffer.getvalue().encode(), producer_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+
+    #a replayed submit (double click, rerun) is already in the draft and gets no new ID, corrected answers are a new submission
+    producer_submission = submission_id("producer", new_data)
+    if not submission_seen(producer_submission):
+        #use the producer ID function
+        new_data['producer_id'] = generate_unique_id(new_data['firstname'], new_data['lastname'], new_data['email'], new_data['phone'])
+
+        #save producer ID into session state to take to the second form
+        st.session_state['producer_id'] = new_data['producer_id']
+
+        #held with the session's fields and saved together on Finish (see submission_queue.draft_row)
+        draft_row(producer_FILE_PATH, new_data, expected_columns, producer_submission)
+        #point their name, email and phone at the ID for next time (saved with the draft)
+        remember_producer(producer_FILE_PATH, new_data['producer_id'], new_data['firstname'], new_data['lastname'], new_data['email'], new_data['phone'], draft=True)
 
     #Display updated file
     #st.write(df) 
@@ -533,7 +489,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     # CROP PURPOSE
     cp = st.selectbox(
         "Primary Crop Purpose",
-        ("--","seed","grain","forage","dual-purpose","other"),
+        CROP_PURPOSE_OPTIONS,
         key=f"cp_{field_idx}"
     )
     if cp == "other":
@@ -543,7 +499,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     else:
         new_data["crop_purpose"] = cp
 
-    new_data["irr"] = st.radio("Field Irrigated?", options = ("yes","no"), horizontal = True, key=f"irr_{field_idx}")
+    new_data["irr"] = st.radio("Field Irrigated?", options = YES_NO, horizontal = True, key=f"irr_{field_idx}")
     new_data["field_size"] = st.text_input("Field Size (*acres*)", key=f"field_size_{field_idx}")
 
     # =========================
@@ -553,12 +509,12 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     new_data["prev_crop_year"] = right.text_input("Harvest Year", key=f"pcy_{field_idx}")
     new_data["prev_crop_purpose"] = st.selectbox(
         "Previous Crop Purpose",
-        ("--", "Grain","Seed","Forage","Silage","Other"),
+        PREV_CROP_PURPOSE_OPTIONS,
         key=f"pcp_{field_idx}"
     )
     new_data["prev_crop_irr"] = st.radio(
         "Previous crop irrigated?",
-        ("yes","no"),
+        YES_NO,
         horizontal=True,
         key=f"pci_{field_idx}"
     )
@@ -577,7 +533,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     left, right = st.columns(2)
     new_data["yield"] = left.text_input("Grain Yield", key=f"y_{field_idx}")
     yu = right.selectbox(
-        "Yield Unit", ("bu/ac","lb/ac","kg/ha","other"), key=f"yu_{field_idx}"
+        "Yield Unit", YIELD_UNIT_OPTIONS, key=f"yu_{field_idx}"
     )
     if yu == "other":
         new_data["yield_unit"] = st.text_input(
@@ -596,16 +552,16 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     left, right = st.columns(2)
     new_data["seed_source"] = left.selectbox(
-        "Seed Source",("--","Saved","Cerified","Registered") ,key=f"seed_source_{field_idx}"
+        "Seed Source", SEED_SOURCE_OPTIONS,key=f"seed_source_{field_idx}"
     )
     new_data["seed_treat"] = right.selectbox(
-        "Seed Treatment",("--","none", "both","funicide","herbicide") ,key=f"seed_treat_{field_idx}"
+        "Seed Treatment", SEED_TREAT_OPTIONS,key=f"seed_treat_{field_idx}"
     )
 
     new_data["profile_h20"] = st.text_input(
         "Profile water at planting details", key=f"profile_h20_{field_idx}"
     )
-    new_data["profile_h20_rank"] = st.radio("Rank Profile Water at Planting", options = ("--", "A","B","C"), horizontal = True, key=f"profile_h20_rank_{field_idx}")
+    new_data["profile_h20_rank"] = st.radio("Rank Profile Water at Planting", options = PROFILE_H20_RANK_OPTIONS, horizontal = True, key=f"profile_h20_rank_{field_idx}")
 
     left, middle, right = st.columns(3)
     new_data["row_space"] = left.text_input(
@@ -615,10 +571,10 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
         "Seeding Rate",key=f"seeding_rate_{field_idx}"
     )
     new_data["seed_rate_unit"] = right.selectbox(
-        "Seeding Rate Unit",("--","lb/ac","plants/ac","seeds/ac") ,key=f"seed_rate_unit_{field_idx}"
+        "Seeding Rate Unit", SEED_RATE_UNIT_OPTIONS,key=f"seed_rate_unit_{field_idx}"
     )
 
-    new_data['tillage']= st.selectbox("Tillage", ("--","no-till","minimal","full"), key =f"tillage_{field_idx}" )
+    new_data['tillage']= st.selectbox("Tillage", TILLAGE_OPTIONS, key =f"tillage_{field_idx}" )
 
     # =========================
     # SOIL TESTS
@@ -640,7 +596,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     st.markdown("<p style='font-size:16px; margin-bottom:4px;'>Manure Details</p>",
         unsafe_allow_html=True
     )
-    new_data["manure"] = st.radio ("Manure Use?", options = ("yes","no"), horizontal = True, key=f"manure_{field_idx}" )
+    new_data["manure"] = st.radio ("Manure Use?", options = YES_NO, horizontal = True, key=f"manure_{field_idx}" )
     left, right = st.columns(2)
     new_data["manure_rate"] = left.text_input(
         "Rate (ex: 30 t/ac)", key=f"manure_rate_{field_idx}"
@@ -653,7 +609,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
     # Nutrient products
     st.markdown("**List ALL nutrients applied**")
 
-    for i in range(1, 7):
+    for i in NUTRIENT_PRODUCTS:
         with st.expander(f"Product {i}"):
             left, middle, right = st.columns(3)
             new_data[f"{i}_product"] = left.text_input(
@@ -663,19 +619,13 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
                 "Rate of application", key=f"{i}_rate_{field_idx}"
             )
             new_data[f"{i}_rate_unit"] = right.selectbox(
-                "Unit", options = ("lb/ac","gal/ac","oz/ac"), key=f"{i}_rate_unit_{field_idx}"
+                "Unit", options = RATE_UNIT_OPTIONS, key=f"{i}_rate_unit_{field_idx}"
             )
 
             left, mid, right = st.columns(3)
             new_data[f"{i}_time"] = left.selectbox(
                 "Time of Application",
-                (
-                    "pre-plant/at-drilling",
-                    "Fall",
-                    "Green-up/top-dress",
-                    "Late season",
-                    "Post Harvest",
-                ),
+                APPLICATION_TIME_OPTIONS,
                 key=f"{i}_time_{field_idx}",
             )
             new_data[f"{i}_date"] = mid.date_input(
@@ -690,23 +640,23 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
             
             new_data[f"{i}_plus"] = st.radio(
                 "Nutrient applied with?",
-                ("None", "Herbicide", "Fertigation", "Fungicide"),
+                APPLIED_WITH_OPTIONS,
                 horizontal=True,
                 key=f"{i}_plus_{field_idx}",
             )
             new_data[f"{i}_vr"] = st.radio(
                 "Variabel Rated?",
-                ("No", "Yes"),
+                VARIABLE_RATE_OPTIONS,
                 horizontal=True,
                 key=f"{i}_vr_{field_idx}",
             )
             
 
-            for n in ["a", "b", "c","d","e","f"]:
+            for n in NUTRIENT_SLOTS:
                 left, right = st.columns(2)
                 new_data[f"{i}_nutrient_{n}"] = left.selectbox(
                     "Specific Nutrient",
-                    ("none","N", "P2O5", "K2O", "S", "Lime", "Micro", "Zinc"),
+                    NUTRIENT_OPTIONS,
                     key=f"{i}_nutrient_{n}_{field_idx}",
                 )
                 new_data[f"{i}_nutrient_{n}_amnt"] = right.text_input(
@@ -719,7 +669,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["fung"] = st.radio(
         "Was fungicide used?",
-        ("Select", "yes", "no"),
+        SELECT_YES_NO,
         horizontal=True,
         key=f"fung_{field_idx}",
     )
@@ -730,7 +680,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["insect"] = st.radio(
         "Was insecticide used?",
-        ("Select", "yes", "no"),
+        SELECT_YES_NO,
         horizontal=True,
         key=f"insect_{field_idx}",
     )
@@ -741,7 +691,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["herb"] = st.radio(
         "Was herbicide used?",
-        ("Select", "yes", "no"),
+        SELECT_YES_NO,
         horizontal=True,
         key=f"herb_{field_idx}",
     )
@@ -755,7 +705,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["irrigated"] = st.radio(
         "Did this wheat crop receive irrigation?",
-        ("Select", "yes", "no"),
+        SELECT_YES_NO,
         horizontal=True,
         key=f"irrigated_{field_idx}",
     )
@@ -769,18 +719,13 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["irr_decision"] = st.selectbox(
         "What drives your irrigation decisions?",
-        (
-            "crop consultant",
-            "moisture probes",
-            "visual assessment",
-            "consistent scheduled dates",
-        ),
+        IRR_DECISION_OPTIONS,
         key=f"irr_decision_{field_idx}",
     )
 
     new_data["irr_type"] = st.selectbox(
         "Irrigation Method",
-        ("center pivot", "drip", "flood", "other"),
+        IRR_TYPE_OPTIONS,
         key=f"irr_type_{field_idx}",
     )
 
@@ -801,7 +746,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
         "System capacity (gal/min)", key=f"sys_cap_{field_idx}"
     )
     new_data["water_source"] = right.selectbox(
-        "Water source", ("Ground", "Surface"), key=f"water_{field_idx}"
+        "Water source", WATER_SOURCE_OPTIONS, key=f"water_{field_idx}"
     )
 
     new_data["capacity_flux"] = st.text_input(
@@ -811,14 +756,14 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
     new_data["pre_plant_water"] = st.radio(
         "Pre-plant water applied?",
-        ("Select", "yes", "no"),
+        SELECT_YES_NO,
         horizontal=True,
         key=f"preplant_{field_idx}",
     )
 
     st.markdown("### Irrigation Events")
 
-    for i in range(1, 9):
+    for i in IRRIGATION_EVENTS:
         with st.expander(f"Irrigation Event {i}"):
             c1, c2, c3 = st.columns(3)
             new_data[f"irr{i}_date"] = c1.date_input(
@@ -830,15 +775,12 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
             )
             new_data[f"irr{i}_month"] = c2.selectbox(
                 "Month",
-                (
-                    "--","Jan","Feb","Mar","Apr","May","Jun",
-                    "Jul","Aug","Sep","Oct","Nov","Dec"
-                ),
+                MONTH_OPTIONS,
                 key=f"irr{i}_month_{field_idx}",
             )
             new_data[f"irr{i}_timing"] = c3.selectbox(
                 "Early or Late",
-                ("--","early", "late"),
+                EARLY_LATE_OPTIONS,
                 key=f"irr{i}_timing_{field_idx}",
             )
 
@@ -854,7 +796,7 @@ with st.form(f"field_form_{field_idx}", clear_on_submit=True):
 
             new_data[f"irr{i}_fertigation"] = st.radio(
                 "Fertigation?",
-                ("no", "yes"),
+                NO_YES,
                 horizontal=True,
                 key=f"irr{i}_fert_{field_idx}",
             )
@@ -889,25 +831,30 @@ div.stAlert:has(svg[data-testid="stSuccessIcon"]) svg {
 # SAVE LOGIC
 if add_field or finish:
 
-    new_data["field_number"] = field_idx
-    new_data["producer_id"] = st.session_state.get("producer_id", "error")
-
-    df = read_csv_from_dropbox_safely(field_FILE_PATH, list(new_data.keys()))
-    df = df.loc[:, ~df.columns.str.contains("^Unnamed")]
+    #one submission per field form, a replayed submit (double click, rerun) is already drafted or saved
+    field_submission = submission_id(f"field_{field_idx}")
+    if not submission_seen(field_submission):
+        new_data["producer_id"] = st.session_state.get("producer_id", "error")
+        #blank until Finish numbers the producer's fields, so a draft saved without Finish (or a counter that can't be
+        #reached) leaves it blank instead of reusing a number; a field without a producer keeps its field index
+        new_data["field_number"] = "" if new_data["producer_id"] else field_idx
 
-    df = pd.concat([df, pd.DataFrame([new_data])], ignore_index=True)
-
-    buf = StringIO()
-    df.to_csv(buf, index=False)
-    dbx.files_upload(
-        buf.getvalue().encode(),
-        field_FILE_PATH,
-        mode=dropbox.files.WriteMode("overwrite")
-    )
+        draft_row(field_FILE_PATH, new_data, list(new_data.keys()), field_submission)
 
     if add_field:
         st.session_state.field_index += 1
         st.rerun()
 
     if finish:
+        #numbered per producer, so a returning producer's fields carry on from their last one (one counter write for all of them)
+        try:
+            number_draft_fields(field_FILE_PATH, producer_FILE_PATH, draft_items())
+        except FIELD_NUMBER_ERRORS:
+            #the counter couldn't be reached, the fields are still saved (without a field number, as in keepsafe.py)
+            pass
+        #producer and every field saved in one go
+        commit_draft()
         st.success("Submission complete. You may close the window.")
+
+#let the respondent know if submissions are still being saved
+show_save_status()
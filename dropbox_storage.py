@@ -0,0 +1,1156 @@
+#==================================================================================================================================
+#Dropbox storage helpers
+#==================================================================================================================================
+#shared by Survey_deploy.py and keepsafe.py
+#nothing here touches the network until a code path actually needs data (see get_dbx)
+#anything decorated with st.cache_resource lives once per server process and is shared by every session
+
+#import modules
+import io
+import os
+import gzip
+import csv
+import threading
+import time
+import datetime
+import uuid
+import random
+import re
+import zlib
+import requests
+import dropbox
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from io import StringIO, BytesIO
+from survey_schema import table_schema, read_csv_options, apply_schema, concat_tables
+
+TOKEN_URL = "https://api.dropboxapi.com/oauth2/token"
+
+#background refresh starts this many seconds before the token expires
+TOKEN_REFRESH_MARGIN = 300
+
+#a rerun only blocks on a refresh if the token is this close to expiring
+TOKEN_EXPIRY_SLACK = 60
+
+#wait before retrying a failed background refresh
+TOKEN_RETRY_DELAY = 30
+
+#keep-alive connections shared by every session (raise if many people upload at once)
+DROPBOX_POOL_SIZE = 16
+
+
+def get_new_access_token(app_key, app_secret, refresh_token):
+    """Exchange the refresh token for a new access token, returns (token, expires_in)"""
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+    }
+    auth = (app_key, app_secret)
+
+    response = requests.post(TOKEN_URL, data=data, auth=auth)
+    response.raise_for_status()
+    tokens = response.json()
+    return tokens["access_token"], tokens.get("expires_in", 14400)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Access token
+
+class TokenManager:
+    """Hold one access token per process and refresh it in the background before it expires"""
+
+    def __init__(self, app_key, app_secret, refresh_token):
+        self._app_key = app_key
+        self._app_secret = app_secret
+        self._refresh_token = refresh_token
+
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._generation = 0 #bumped on every refresh so waiting sessions can tell one already happened
+        self._timer = None
+
+    def get(self):
+        """Return a valid access token, only blocking if there is none or it is about to expire"""
+        generation = self._generation
+        if self._token is not None and time.monotonic() < self._expires_at - TOKEN_EXPIRY_SLACK:
+            return self._token
+        return self._refresh(generation)
+
+    def _refresh(self, seen_generation):
+        with self._lock:
+            #another session refreshed while we waited on the lock, share its token
+            if self._generation != seen_generation and self._token is not None:
+                return self._token
+
+            token, expires_in = get_new_access_token(self._app_key, self._app_secret, self._refresh_token)
+            self._token = token
+            self._expires_at = time.monotonic() + expires_in
+            self._generation += 1
+            self._schedule(max(expires_in - TOKEN_REFRESH_MARGIN, TOKEN_RETRY_DELAY))
+            return token
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True #don't keep the server alive on shutdown
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh(self._generation)
+        except requests.RequestException:
+            #current token is still good for a while, try again shortly
+            with self._lock:
+                self._schedule(TOKEN_RETRY_DELAY)
+
+
+@st.cache_resource(show_spinner=False)
+def get_token_manager(app_key, app_secret, refresh_token):
+    """One token manager per server process"""
+    return TokenManager(app_key, app_secret, refresh_token)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Dropbox client
+
+class PooledDropbox:
+    """One pooled requests.Session per process, rebound to whatever token is current"""
+
+    def __init__(self, token_manager, pool_size=DROPBOX_POOL_SIZE):
+        self._token_manager = token_manager
+        self._session = dropbox.create_session(max_connections=pool_size)
+        self._lock = threading.Lock()
+        self._token = None
+        self._dbx = None
+
+    def client(self):
+        """Return a Dropbox client for the current token, keeping the same connection pool"""
+        token = self._token_manager.get()
+        if token == self._token:
+            return self._dbx
+
+        with self._lock:
+            if token != self._token:
+                if self._dbx is None:
+                    self._dbx = dropbox.Dropbox(token, session=self._session)
+                else:
+                    #clone keeps the session, so open connections survive the new token
+                    self._dbx = self._dbx.clone(oauth2_access_token=token)
+                self._token = token
+            return self._dbx
+
+
+@st.cache_resource(show_spinner=False)
+def get_pooled_dropbox(app_key, app_secret, refresh_token, pool_size=DROPBOX_POOL_SIZE):
+    """One pooled Dropbox client per server process"""
+    return PooledDropbox(get_token_manager(app_key, app_secret, refresh_token), pool_size)
+
+
+def get_dropbox_client(app_key, app_secret, refresh_token, pool_size=DROPBOX_POOL_SIZE):
+    """Shortcut for the process-wide client bound to the current token"""
+    return get_pooled_dropbox(app_key, app_secret, refresh_token, pool_size).client()
+
+
+def get_dbx():
+    """Process-wide Dropbox client, secrets are read and the client built on first use"""
+    creds = st.secrets["dropbox"]
+    return get_dropbox_client(creds["app_key"], creds["app_secret"], creds["refresh_token"])
+
+
+#___________________________________________________________________________________________________________________________________________
+# Reading and writing tables
+
+#within this many seconds of the last check a cached table is used without asking Dropbox
+TABLE_REVISION_TTL = 5
+
+
+class TableCache:
+    """Parsed tables shared by every session, keyed by Dropbox path and validated by file rev"""
+
+    def __init__(self, ttl=TABLE_REVISION_TTL):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self._entries = {} #path, or (path, columns) for a projection -> {"rev", "data", "checked_at"}
+        self._listings = {} #(records folder, first day listed) -> {"paths", "checked_at"}
+        self._immutable = {} #record/snapshot path (or (path, columns)) -> parsed data, these never change once written
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def get(self, path, parse=None):
+        """Return the parsed file at path, downloading only if its rev changed since the last read"""
+        return self.get_with_rev(path, parse)[0]
+
+    def get_with_rev(self, path, parse=None, fresh=False):
+        """Parsed file and the rev it was read at, fresh=True always checks the rev with Dropbox"""
+        parse = parse or _parse_csv
+        #one download per path at a time, the other sessions wait and reuse it
+        with self._path_lock(path):
+            entry = self._entries.get(path)
+            now = time.monotonic()
+
+            if entry is not None and not fresh and now - entry["checked_at"] < self._ttl:
+                return entry["data"], entry["rev"]
+
+            dbx = get_dbx()
+            metadata = None
+            if entry is not None:
+                #cheap metadata call, skip the download if nobody wrote since
+                metadata = dbx.files_get_metadata(path)
+                if metadata.rev == entry["rev"]:
+                    entry["checked_at"] = now
+                    return entry["data"], entry["rev"]
+
+            self._entries[path] = self._download(dbx, path, parse, entry, metadata, now)
+            return self._entries[path]["data"], self._entries[path]["rev"]
+
+    def get_columns(self, path, columns, parse):
+        """Only some columns of the file at path, parse must read just those"""
+        #a cached full table answers by slicing, otherwise only the projection is parsed and cached
+        key = (path, tuple(columns))
+        with self._path_lock(path):
+            full = self._entries.get(path)
+            entry = self._entries.get(key)
+            now = time.monotonic()
+
+            if full is not None and now - full["checked_at"] < self._ttl:
+                return _project(full["data"], columns)
+            if entry is not None and now - entry["checked_at"] < self._ttl:
+                return entry["data"]
+
+            dbx = get_dbx()
+            metadata = None
+            if full is not None or entry is not None:
+                metadata = dbx.files_get_metadata(path)
+                if full is not None and full["rev"] == metadata.rev:
+                    full["checked_at"] = now
+                    return _project(full["data"], columns)
+                if entry is not None and entry["rev"] == metadata.rev:
+                    entry["checked_at"] = now
+                    return entry["data"]
+
+            self._entries[key] = self._download(dbx, path, parse, entry, metadata, now)
+            return self._entries[key]["data"]
+
+    def _download(self, dbx, path, parse, entry, metadata, now):
+        """New cache entry for a file that changed, only fetching the appended bytes if it just grew"""
+        if entry is not None and metadata is not None and get_tail_sync():
+            synced = _sync_tail(dbx, path, entry, metadata, parse)
+            if synced is not None:
+                return dict(synced, checked_at=now)
+
+        metadata, res = dbx.files_download(path)
+        data, tail = _parse_response(res, parse, track=True)
+        if tail is not None and tail["size"] != metadata.size:
+            tail = None #the parser stopped early, we don't know where the file ends
+        return {"rev": metadata.rev, "data": data, "tail": tail, "checked_at": now}
+
+    def put(self, path, rev, data, tail=None):
+        """Write-through after an upload so the next read doesn't fetch what we just wrote"""
+        #tail: end of the uploaded csv (see _tail_state), lets the next read of a grown file fetch only the new rows
+        with self._path_lock(path):
+            self._drop_projections(path)
+            self._entries[path] = {"rev": rev, "data": data, "tail": tail, "checked_at": time.monotonic()}
+
+    def invalidate(self, path):
+        with self._path_lock(path):
+            self._drop_projections(path)
+            self._entries.pop(path, None)
+
+    def _drop_projections(self, path):
+        #other paths' entries are added meanwhile under their own locks, so go over a copy of the keys
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            if isinstance(key, tuple) and key[0] == path:
+                self._entries.pop(key, None)
+
+    def get_immutable(self, path, parse=None, columns=None):
+        """Parsed file that is never rewritten (records, snapshots), downloaded once per process"""
+        #columns: parse only reads those, cached apart from the full parse
+        parse = parse or _parse_csv
+        key = path if columns is None else (path, tuple(columns))
+        with self._path_lock(path):
+            if key not in self._immutable:
+                metadata, res = get_dbx().files_download(path)
+                self._immutable[key] = _parse_response(res, parse)
+            return self._immutable[key]
+
+    def get_records(self, folder, skip=(), after=None, parse=None):
+        """(path, parsed record) pairs under folder in write order except those in skip, only unseen records are downloaded"""
+        #after: only records named after it, and only its day folder onward is listed (see compact_table)
+        #parse: the table's parser, record file names say nothing about the table's schema
+        since = None if after is None else _record_day(after)
+        with self._path_lock(folder):
+            listing = self._listings.get((folder, since))
+            now = time.monotonic()
+
+            if listing is None or now - listing["checked_at"] >= self._ttl:
+                listing = {"paths": sorted(_list_records(folder, since)), "checked_at": now}
+                self._listings[(folder, since)] = listing
+            paths = listing["paths"]
+
+        return [
+            (record_path, self.get_immutable(record_path, parse)) for record_path in paths
+            if record_path not in skip and (after is None or record_path > after)
+        ]
+
+    def put_record(self, folder, record_path, df):
+        """Write-through for a record we just uploaded"""
+        with self._path_lock(record_path):
+            self._immutable[record_path] = df
+        with self._lock:
+            listings = list(self._listings.items())
+        with self._path_lock(folder):
+            for (listed, since), listing in listings:
+                if listed != folder or (since is not None and _record_day(record_path) < since):
+                    continue
+                if record_path not in listing["paths"]:
+                    listing["paths"] = sorted(listing["paths"] + [record_path])
+
+
+@st.cache_resource(show_spinner=False)
+def get_table_cache():
+    """One table cache per server process"""
+    return TableCache()
+
+
+#bytes pulled from the download response at a time while parsing
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class _ResponseStream(io.RawIOBase):
+    """Read-only file object over a streamed download, so parsers pull the body chunk by chunk"""
+
+    def __init__(self, res):
+        self._chunks = res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        self._left = b""
+        #kept for tail sync: the first chunk (header), the last bytes and how many bytes went by
+        self.head = None
+        self.tail = b""
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._left:
+            self._left = next(self._chunks, b"")
+            if self.head is None:
+                self.head = self._left
+            self.size += len(self._left)
+            self.tail = (self.tail + self._left)[-TAIL_SYNC_OVERLAP:]
+        n = min(len(b), len(self._left))
+        b[:n] = self._left[:n]
+        self._left = self._left[n:]
+        return n
+
+
+def _parse_response(res, parse, track=False):
+    """Feed a download response straight into a parser without building the whole body in memory first"""
+    #track=True also returns the tail sync state of the file (None unless it is a plain csv)
+    raw = _ResponseStream(res)
+    try:
+        data = parse(io.BufferedReader(raw, DOWNLOAD_CHUNK_SIZE))
+    finally:
+        res.close()
+    if not track:
+        return data
+    return data, _tail_state(raw.head or b"", raw.tail, raw.size)
+
+
+def _parse_csv(stream, **read_options):
+    """Parse a csv from a binary file object, None if the file is empty or has no header row"""
+    # Check that the first line contains headers, only looking at what is already buffered
+    head = stream.peek(DOWNLOAD_CHUNK_SIZE).lstrip()
+    if not head:
+        return None
+
+    if b',' not in head.split(b"\n", 1)[0]:
+        return None
+
+    try:
+        return pd.read_csv(stream, **read_options)
+    except pd.errors.EmptyDataError:
+        return None
+
+
+def _parse_parquet(stream):
+    #parquet needs to seek, so this one is read whole
+    return pd.read_parquet(BytesIO(stream.read()))
+
+
+def _parquet_parser(usecols):
+    """Parquet parser that decodes only the columns in usecols (the file is still downloaded whole)"""
+    def parse(stream):
+        buffer = BytesIO(stream.read())
+        columns = [c for c in pq.read_schema(buffer).names if c in usecols]
+        buffer.seek(0)
+        return pd.read_parquet(buffer, columns=columns)
+    return parse
+
+
+#first bytes of the compressed table formats
+GZIP_MAGIC = b"\x1f\x8b"
+PARQUET_MAGIC = b"PAR1"
+
+
+class _TableParser:
+    """Parser for the table at path in any of its formats, typed by its schema (see survey_schema.py), usecols parses only those"""
+    #the format is told from the first bytes, so a table can be switched to another format at any time
+
+    def __init__(self, path, usecols=None):
+        self.schema = table_schema(path)
+        self.usecols = usecols
+        self.read_options = read_csv_options(self.schema)
+        if usecols is not None:
+            #a callable, so asking for a column an older table doesn't have isn't an error
+            self.read_options["usecols"] = lambda column: column in usecols
+
+    def __call__(self, stream):
+        head = stream.peek(len(PARQUET_MAGIC))
+        if head.startswith(PARQUET_MAGIC):
+            df = _parse_parquet(stream) if self.usecols is None else _parquet_parser(self.usecols)(stream)
+        elif head.startswith(GZIP_MAGIC):
+            #decompressed as the download streams in
+            df = _parse_csv(io.BufferedReader(gzip.GzipFile(fileobj=stream), DOWNLOAD_CHUNK_SIZE), **self.read_options)
+        else:
+            df = _parse_csv(stream, **self.read_options)
+        return apply_schema(df, self.schema)
+
+    def append(self, df, stream, header):
+        """df followed by the csv rows (no header line) in stream"""
+        rows = pd.read_csv(stream, header=None, names=header, **self.read_options)
+        return concat_tables([df, rows], self.schema)
+
+
+def _table_parser(path, usecols=None):
+    return _TableParser(path, usecols)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Tail sync: when a plain csv table only grew since we read it, download just the new rows (HTTP Range)
+
+#bytes before the old end of file downloaded again and compared, so a rewrite isn't mistaken for an append
+TAIL_SYNC_OVERLAP = 4096
+
+#revisions looked back through for the one we hold, more writes than this since and we fetch the whole file
+TAIL_SYNC_REVISIONS = 20
+
+
+def get_tail_sync():
+    """Tail sync on unless [storage] tail_sync = false in secrets"""
+    return st.secrets.get("storage", {}).get("tail_sync", True)
+
+
+def _tail_state(head, tail, size):
+    """What tail sync needs to know about a downloaded or uploaded file, None unless it is a plain csv"""
+    if not head or head.startswith(PARQUET_MAGIC) or head.startswith(GZIP_MAGIC):
+        return None
+    header_line, newline, _ = head.partition(b"\n")
+    #rows are only appended after a complete last line
+    if not newline or not tail.endswith(b"\n"):
+        return None
+    header = next(csv.reader([header_line.decode("utf-8").rstrip("\r")]))
+    return {"size": size, "tail": tail, "header": header}
+
+
+def _only_grew(dbx, path, rev):
+    """True if every revision of path since rev is at least as big as the one before it (nothing was cut or rewritten shorter)"""
+    revisions = dbx.files_list_revisions(path, limit=TAIL_SYNC_REVISIONS).entries #newest first
+    revs = [r.rev for r in revisions]
+    if rev not in revs:
+        return False
+    sizes = [r.size for r in reversed(revisions[:revs.index(rev) + 1])]
+    return all(later >= earlier for earlier, later in zip(sizes, sizes[1:]))
+
+
+def _sync_tail(dbx, path, entry, metadata, parse):
+    """Entry extended with the rows appended to path since it was read, None if a full download is needed"""
+    state = entry.get("tail")
+    if state is None or entry["data"] is None or not hasattr(parse, "append"):
+        return None
+    if metadata.size <= state["size"] or not _only_grew(dbx, path, entry["rev"]):
+        return None
+
+    start = state["size"] - len(state["tail"])
+    try:
+        metadata, res = dbx.files_download(path, extra_headers={"Range": f"bytes={start}-"})
+    except (dropbox.exceptions.ApiError, dropbox.exceptions.HttpError):
+        #rewritten shorter since we looked, the range no longer fits
+        return None
+    try:
+        body = b"".join(res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+    finally:
+        res.close()
+
+    #the bytes we already had must still be there, right before the new ones
+    if not body.startswith(state["tail"]) or start + len(body) != metadata.size:
+        return None
+    new_rows = body[len(state["tail"]):]
+    if not new_rows.endswith(b"\n"):
+        return None
+
+    data = parse.append(entry["data"], BytesIO(new_rows), state["header"])
+    tail = {"size": metadata.size, "tail": body[-TAIL_SYNC_OVERLAP:], "header": state["header"]}
+    return {"rev": metadata.rev, "data": data, "tail": tail}
+
+
+def _project(df, usecols):
+    """The columns of df that are in usecols, in usecols order"""
+    if df is None or usecols is None:
+        return df
+    return df[[c for c in usecols if c in df.columns]]
+
+
+def _table_or_empty(df, columns):
+    #hand out copies, callers concat and slice the table they get back
+    if df is None:
+        return pd.DataFrame(columns=columns)
+    return df.copy()
+
+
+def _list_entries(folder, recursive=True):
+    """Every entry in (or below) folder, empty if the folder doesn't exist yet"""
+    dbx = get_dbx()
+    try:
+        result = dbx.files_list_folder(folder, recursive=recursive)
+    except dropbox.exceptions.ApiError:
+        return []
+
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return entries
+
+
+def _list_files(folder):
+    """Every file below folder, empty if the folder doesn't exist yet"""
+    return [e for e in _list_entries(folder) if isinstance(e, dropbox.files.FileMetadata)]
+
+
+def _record_day(record_path):
+    """Day folder of a record (or of a high-water mark), .../records/fields_info/2025-06-30/... -> 2025-06-30"""
+    return record_path.rsplit("/", 2)[-2]
+
+
+def _list_records(folder, since=None):
+    """Record paths under a records folder, only from the day folder since onward if set"""
+    if since is None:
+        return [e.path_display for e in _list_files(folder)]
+    #one call for the day folders, then only the recent days are listed
+    days = [e.name for e in _list_entries(folder, recursive=False) if isinstance(e, dropbox.files.FolderMetadata)]
+    return [e.path_display for day in sorted(days) if day >= since for e in _list_files(f"{folder}/{day}")]
+
+
+#___________________________________________________________________________________________________________________________________________
+# Table file formats
+
+#how table mode stores a table ([storage] format in secrets), the app keeps passing the .csv path
+#"csv" plain csv, "csv.gz" gzipped csv, "parquet" columnar with zstd
+#mostly empty product and irrigation event columns shrink more than tenfold compressed
+DEFAULT_TABLE_FORMAT = "csv"
+TABLE_FORMAT_EXTENSIONS = {"csv": ".csv", "csv.gz": ".csv.gz", "parquet": ".parquet"}
+
+#gzip level for csv.gz, higher levels cost a lot of time for a few percent
+GZIP_LEVEL = 6
+
+
+def get_table_format():
+    """Table file format from secrets ([storage] format = "parquet"), csv if not set"""
+    return st.secrets.get("storage", {}).get("format", DEFAULT_TABLE_FORMAT)
+
+
+def stored_path(path):
+    """Where the table at path is kept in the configured format, /streamlit/fields_info.csv -> /streamlit/fields_info.parquet"""
+    return os.path.splitext(path)[0] + TABLE_FORMAT_EXTENSIONS[get_table_format()]
+
+
+def _serialize_table(df, path):
+    """File contents for the table in the format its path's extension names"""
+    buffer = BytesIO()
+    if path.endswith(".parquet"):
+        try:
+            df.to_parquet(buffer, index=False, compression="zstd")
+        except (ValueError, TypeError, pa.ArrowException):
+            #a column the schema doesn't know holds mixed types, give it one first
+            buffer = BytesIO()
+            _normalize_dtypes(df, table_schema(path)).to_parquet(buffer, index=False, compression="zstd")
+    elif path.endswith(".gz"):
+        df.to_csv(buffer, index=False, compression={"method": "gzip", "compresslevel": GZIP_LEVEL, "mtime": 0})
+    else:
+        df.to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
+
+
+def _read_stored_table(path, usecols=None, fresh=False):
+    """(table, rev, stored path) of the table at path, from the plain csv until the first write in another format"""
+    cache = get_table_cache()
+    stored = stored_path(path)
+    candidates = [stored] if stored == path else [stored, path]
+    for i, candidate in enumerate(candidates):
+        try:
+            if usecols is None:
+                df, rev = cache.get_with_rev(candidate, _table_parser(candidate), fresh=fresh)
+            else:
+                df, rev = cache.get_columns(candidate, usecols, _table_parser(candidate, usecols)), None
+            #the rev only matters for writing the stored file, a legacy csv can't be written against
+            return df, (rev if candidate == stored else None), stored
+        except dropbox.exceptions.ApiError as e:
+            if not _is_not_found(e) or i == len(candidates) - 1:
+                raise
+
+
+#read csv, populate fields if starting empty
+#usecols: only these columns are parsed (lookups that need two or three columns of a wide table)
+def read_csv_from_dropbox_safely(path, columns, usecols=None):
+    if get_storage_mode() == "records":
+        return _read_snapshot_and_tail(path, columns, usecols)
+    if partition_columns(path):
+        return read_partitions(path, columns, usecols)
+
+    try:
+        df = _read_stored_table(path, usecols)[0]
+        return _table_or_empty(df, columns if usecols is None else usecols)
+    
+    except dropbox.exceptions.ApiError as e:
+        st.warning(f"Dropbox API error or file not found: {e}")
+        return pd.DataFrame(columns=usecols or columns)
+
+
+def read_table_strict(path, columns, usecols=None):
+    """Like read_csv_from_dropbox_safely, but only a table that doesn't exist yet reads as empty, other errors are raised"""
+    #for reads whose result is kept (indexes, ID allocation), where a failed read mustn't pass for an empty table
+    if get_storage_mode() == "records":
+        return _read_snapshot_and_tail(path, columns, usecols)
+    if partition_columns(path):
+        return read_partitions(path, columns, usecols)
+
+    try:
+        df = _read_stored_table(path, usecols)[0]
+    except dropbox.exceptions.ApiError as e:
+        if not _is_not_found(e):
+            raise
+        return pd.DataFrame(columns=usecols or columns)
+    return _table_or_empty(df, columns if usecols is None else usecols)
+
+
+def write_csv_to_dropbox(df, path, mode=None):
+    """Upload the table at path (overwrite unless a WriteMode is given) and update the shared cache with what was written"""
+    #the format follows the path's extension: .csv, .csv.gz or .parquet
+    mode = mode or dropbox.files.WriteMode("overwrite")
+    data = _serialize_table(df, path)
+    metadata = get_dbx().files_upload(data, path, mode=mode)
+    tail = _tail_state(data[:DOWNLOAD_CHUNK_SIZE], data[-TAIL_SYNC_OVERLAP:], len(data))
+    get_table_cache().put(path, metadata.rev, apply_schema(df.copy(), table_schema(path)), tail)
+    return metadata
+
+
+#___________________________________________________________________________________________________________________________________________
+# Append-only submission records
+
+#"table" rewrites the whole csv on every submit
+#"records" writes each submission as its own small file, cost stays the same however big the tables get
+DEFAULT_STORAGE_MODE = "table"
+
+
+def get_storage_mode():
+    """Storage mode from secrets ([storage] mode = "records"), table if not set"""
+    return st.secrets.get("storage", {}).get("mode", DEFAULT_STORAGE_MODE)
+
+
+def records_folder(path):
+    """Folder holding the submission records of a table, /streamlit/fields_info.csv -> /streamlit/records/fields_info"""
+    folder, name = path.rsplit("/", 1)
+    return f"{folder}/records/{os.path.splitext(name)[0]}"
+
+
+def write_record(path, rows):
+    """Write submitted rows as their own immutable csv, partitioned by day"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    folder = records_folder(path)
+    #names sort in write order, the random suffix keeps two sessions in the same microsecond apart
+    record_path = f"{folder}/{now:%Y-%m-%d}/{now:%Y%m%dT%H%M%S%f}_{uuid.uuid4().hex[:12]}.csv"
+
+    csv_buffer = StringIO()
+    pd.DataFrame(rows).to_csv(csv_buffer, index=False)
+    data = csv_buffer.getvalue().encode()
+    metadata = get_dbx().files_upload(data, record_path, mode=dropbox.files.WriteMode("add"))
+    #parsed like a download would be, typed by the table's schema (producer_id "000050" stays text)
+    get_table_cache().put_record(folder, record_path, _table_parser(path)(io.BufferedReader(BytesIO(data))))
+    return metadata
+
+
+def append_row(path, row, columns):
+    """Add one submitted row to the table at path using the configured storage mode"""
+    return append_rows(path, [row], columns)
+
+
+def append_rows(path, rows, columns):
+    """Add several rows with a single write (one record file, or one table upload)"""
+    #a .json path is a keyed store (see update_json), each row is a dict of keys to set
+    if path.endswith(".json"):
+        return update_json(path, lambda store: [store.update(row) for row in rows])
+    if get_storage_mode() == "records":
+        return write_record(path, rows)
+    if partition_columns(path):
+        return append_partitioned(path, rows, columns)
+    return append_rows_to_table(path, rows, columns)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Optimistic-concurrency table writes
+
+#attempts before giving up when other sessions keep writing the same table
+WRITE_MAX_ATTEMPTS = 5
+
+#first retry waits about this long (seconds), doubled on every attempt
+WRITE_BACKOFF = 0.2
+
+
+def _is_not_found(e):
+    """True if a download or metadata call failed because there is no file at the path"""
+    error = e.error
+    return (
+        isinstance(error, (dropbox.files.DownloadError, dropbox.files.GetMetadataError))
+        and error.is_path()
+        and error.get_path().is_not_found()
+    )
+
+
+def _is_write_conflict(e):
+    """True if an upload failed because the file changed since the rev we wrote against"""
+    error = e.error
+    return (
+        isinstance(error, dropbox.files.UploadError)
+        and error.is_path()
+        and error.get_path().reason.is_conflict()
+    )
+
+
+def append_rows_to_table(path, rows, columns):
+    """Append rows to the table at path (in the configured format) without losing rows another session wrote at the same time"""
+    #the upload only succeeds if the file is still at the rev we read,
+    #otherwise someone wrote in between: re-read, re-append our rows and try again
+    cache = get_table_cache()
+    stored = stored_path(path)
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        try:
+            df, rev, stored = _read_stored_table(path, fresh=True)
+        except dropbox.exceptions.ApiError:
+            #no table yet, the upload below creates it (or conflicts if someone beats us to it)
+            df, rev = None, None
+
+        df = _table_or_empty(df, columns)
+        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]  #to correct problems with unnamed columns
+        df = concat_tables([df, pd.DataFrame(rows)], table_schema(path))
+
+        if rev is None:
+            mode = dropbox.files.WriteMode("add")
+        else:
+            mode = dropbox.files.WriteMode("update", rev)
+
+        try:
+            return write_csv_to_dropbox(df, stored, mode)
+        except dropbox.exceptions.ApiError as e:
+            if not _is_write_conflict(e) or attempt == WRITE_MAX_ATTEMPTS - 1:
+                raise
+            cache.invalidate(stored)
+            #jitter so sessions that collided don't collide again
+            time.sleep(WRITE_BACKOFF * 2 ** attempt * (0.5 + random.random()))
+
+
+#___________________________________________________________________________________________________________________________________________
+# Keyed json stores (indexes and counters kept next to the tables)
+
+def read_json(path):
+    """The json object at path through the shared cache (rev-checked), None if there is no file yet"""
+    try:
+        return get_table_cache().get(path, _parse_json)
+    except dropbox.exceptions.ApiError as e:
+        if _is_not_found(e):
+            return None
+        raise
+
+
+def update_json(path, update):
+    """Apply update(store) to a copy of the json object at path and write it back against the rev we read, returns update's result"""
+    #same optimistic loop as append_rows_to_table: on a conflict re-read, re-apply and try again
+    cache = get_table_cache()
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        try:
+            store, rev = cache.get_with_rev(path, _parse_json, fresh=True)
+        except dropbox.exceptions.ApiError as e:
+            if not _is_not_found(e):
+                raise
+            store, rev = None, None
+
+        #the cached object is shared with other sessions, never change it in place
+        store = dict(store or {})
+        result = update(store)
+
+        if rev is None:
+            mode = dropbox.files.WriteMode("add")
+        else:
+            mode = dropbox.files.WriteMode("update", rev)
+
+        try:
+            metadata = get_dbx().files_upload(json.dumps(store).encode(), path, mode=mode)
+        except dropbox.exceptions.ApiError as e:
+            if not _is_write_conflict(e) or attempt == WRITE_MAX_ATTEMPTS - 1:
+                raise
+            cache.invalidate(path)
+            time.sleep(WRITE_BACKOFF * 2 ** attempt * (0.5 + random.random()))
+            continue
+
+        cache.put(path, metadata.rev, store)
+        return result
+
+
+#___________________________________________________________________________________________________________________________________________
+# Partitioned tables: one small file per survey season and producer bucket (table mode, [storage] partition = true)
+#/streamlit/fields_info.csv -> /streamlit/partitions/fields_info/season=2025/bucket=07/fields_info.csv
+#a submit rewrites only its own partition, the flat table stays readable as the history from before partitioning
+
+#tables that are partitioned, by file stem: (column the season is taken from, column hashed into a bucket)
+PARTITION_COLUMNS = {"fields_info": ("harvest_date", "producer_id")}
+
+#producer buckets per season, producers are spread over them by a stable hash of producer_id
+PARTITION_BUCKETS = 16
+
+#season of rows without a usable date
+UNKNOWN_SEASON = "unknown"
+
+
+def get_partitioning():
+    """Whether partitioned tables are written per season and producer bucket ([storage] partition = true), off if not set"""
+    return bool(st.secrets.get("storage", {}).get("partition", False))
+
+
+def partitions_folder(path):
+    """Folder holding the partitions of a table, /streamlit/fields_info.csv -> /streamlit/partitions/fields_info"""
+    folder, name = path.rsplit("/", 1)
+    return f"{folder}/partitions/{os.path.splitext(name)[0]}"
+
+
+def partition_columns(path):
+    """(season column, producer column) if the table at path is written in partitions, else None"""
+    #records mode already writes one small file per submit, partitions are for table mode
+    if "/partitions/" in path or get_storage_mode() != "table" or not get_partitioning():
+        return None
+    return PARTITION_COLUMNS.get(os.path.basename(path).split(".", 1)[0])
+
+
+def season_of(value):
+    """Survey season (harvest year) of a date, a "2025-07-01" string or a timestamp, "unknown" if there is none"""
+    if hasattr(value, "year") and not pd.isna(value):
+        return str(value.year)
+    match = re.match(r"\s*(\d{4})", str(value)) if isinstance(value, str) else None
+    return match.group(1) if match else UNKNOWN_SEASON
+
+
+def bucket_of(producer_id):
+    """Bucket of a producer (crc32, the same in every process unlike hash())"""
+    return zlib.crc32(str(producer_id).strip().encode()) % PARTITION_BUCKETS
+
+
+def partition_path(path, season, bucket):
+    """Table file of one season and bucket, named like the table so its schema and format apply"""
+    return f"{partitions_folder(path)}/season={season}/bucket={bucket:02d}/{os.path.basename(path)}"
+
+
+def append_partitioned(path, rows, columns):
+    """Append each row to the partition of its season and producer, one write per partition touched"""
+    season_column, producer_column = partition_columns(path)
+    parts = {}
+    for row in rows:
+        part = partition_path(path, season_of(row.get(season_column)), bucket_of(row.get(producer_column)))
+        parts.setdefault(part, []).append(row)
+    return [append_rows_to_table(part, part_rows, columns) for part, part_rows in parts.items()]
+
+
+def list_partitions(path, seasons=None, producer_ids=None):
+    """Partition paths of a table, only the given seasons and the buckets of the given producers if set"""
+    seasons = None if seasons is None else {str(season) for season in seasons}
+    buckets = None if producer_ids is None else {bucket_of(p) for p in producer_ids}
+    name = os.path.basename(path)
+    parts = set()
+    for entry in _list_files(partitions_folder(path)):
+        #the stored file may be .parquet or .csv.gz next to its csv export, both are the same partition
+        folder = entry.path_display.rsplit("/", 1)[0]
+        match = re.search(r"/season=([^/]+)/bucket=(\d+)$", folder)
+        if match is None:
+            continue
+        if seasons is not None and match.group(1) not in seasons:
+            continue
+        if buckets is not None and int(match.group(2)) not in buckets:
+            continue
+        parts.add(f"{folder}/{name}")
+    return sorted(parts)
+
+
+def read_partitions(path, columns, usecols=None, seasons=None, producer_ids=None):
+    """Rows of a partitioned table (the flat table from before partitioning first), pruned to seasons and producers if set"""
+    season_column, producer_column = partition_columns(path) or PARTITION_COLUMNS[os.path.basename(path).split(".", 1)[0]]
+    wanted = usecols
+    #the flat table isn't partitioned, its rows are filtered on the partition columns instead
+    if usecols is not None and (seasons is not None or producer_ids is not None):
+        wanted = list(usecols) + [c for c in (season_column, producer_column) if c not in usecols]
+
+    frames = []
+    for part in [path] + list_partitions(path, seasons, producer_ids):
+        try:
+            frames.append(_read_stored_table(part, wanted)[0])
+        except dropbox.exceptions.ApiError as e:
+            if not _is_not_found(e):
+                raise
+
+    frames = [df for df in frames if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=usecols or columns)
+    df = concat_tables(frames, table_schema(path))
+    if seasons is not None and season_column in df.columns:
+        df = df[df[season_column].map(season_of).isin({str(season) for season in seasons})]
+    if producer_ids is not None and producer_column in df.columns:
+        df = df[df[producer_column].astype("str").str.strip().isin({str(p).strip() for p in producer_ids})]
+    return _table_or_empty(_project(df.reset_index(drop=True), usecols), columns if usecols is None else usecols)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Compaction of submission records into a parquet snapshot
+
+#how often the background compactor folds new records into the snapshot (seconds)
+COMPACTION_INTERVAL = 600
+
+#records younger than this (seconds) are left for the next compaction, so one still uploading isn't passed over
+RECORD_SETTLE_TIME = 300
+
+
+def snapshots_folder(path):
+    """Folder holding the snapshots and manifest of a table, /streamlit/fields_info.csv -> /streamlit/snapshots/fields_info"""
+    folder, name = path.rsplit("/", 1)
+    return f"{folder}/snapshots/{os.path.splitext(name)[0]}"
+
+
+def manifest_path(path):
+    return f"{snapshots_folder(path)}/manifest.json"
+
+
+def _parse_json(stream):
+    content = stream.read()
+    return json.loads(content.decode("utf-8")) if content.strip() else None
+
+
+def _read_legacy_table(path, usecols=None):
+    """The single table file used before records mode, None if there isn't one"""
+    try:
+        return _read_stored_table(path, usecols)[0]
+    except dropbox.exceptions.ApiError as e:
+        if not _is_not_found(e):
+            raise
+        return None
+
+
+def _read_manifest(path):
+    """Current manifest of a table, None until the first compaction"""
+    try:
+        return get_table_cache().get(manifest_path(path), _parse_json)
+    except dropbox.exceptions.ApiError as e:
+        if not _is_not_found(e):
+            raise
+        return None
+
+
+def _read_snapshot_and_tail(path, columns, usecols=None):
+    """Latest snapshot followed by the records written since it was compacted, typed by the table's schema"""
+    cache = get_table_cache()
+    manifest = _read_manifest(path)
+
+    if manifest is None:
+        #not compacted yet, legacy table plus every record
+        base = _read_legacy_table(path, usecols)
+        folded = set()
+    elif usecols is None:
+        base = cache.get_immutable(manifest["snapshot"], _parse_parquet)
+        folded = set(manifest["records"])
+    else:
+        #columnar snapshot, only the projected columns are decoded
+        base = cache.get_immutable(manifest["snapshot"], _parquet_parser(usecols), usecols)
+        folded = set(manifest["records"])
+    through = None if manifest is None else manifest.get("through")
+
+    frames = [] if base is None else [base.loc[:, ~base.columns.str.contains('^Unnamed')]]
+    #records are a row or two each, they are parsed whole and sliced
+    records = cache.get_records(records_folder(path), skip=folded, after=through, parse=_table_parser(path))
+    frames += [_project(df, usecols) for record_path, df in records if df is not None]
+
+    if not frames:
+        return pd.DataFrame(columns=usecols or columns)
+    #each record has only its own categories, they only line up once everything is in one frame
+    if len(frames) == 1:
+        return apply_schema(frames[0].copy(), table_schema(path))
+    return concat_tables(frames, table_schema(path))
+
+
+def _normalize_dtypes(df, schema=None):
+    """Round trip through csv so every column has one dtype: its schema dtype, or what the csv reader would infer"""
+    csv_buffer = StringIO()
+    df.to_csv(csv_buffer, index=False)
+    return apply_schema(pd.read_csv(StringIO(csv_buffer.getvalue()), **read_csv_options(schema)), schema)
+
+
+def compact_table(path):
+    """Fold records not yet in the snapshot into a new parquet snapshot, True if a new one was written"""
+    dbx = get_dbx()
+    cache = get_table_cache()
+
+    #read the manifest straight from Dropbox, we need its current rev to replace it safely
+    try:
+        metadata, res = dbx.files_download(manifest_path(path))
+        manifest, manifest_rev = _parse_response(res, _parse_json), metadata.rev
+    except dropbox.exceptions.ApiError:
+        manifest, manifest_rev = None, None
+
+    if manifest is None:
+        base = _read_legacy_table(path)
+        folded, through = [], None
+    else:
+        base = cache.get_immutable(manifest["snapshot"], _parse_parquet)
+        folded, through = manifest["records"], manifest.get("through")
+
+    #everything named before the cutoff gets folded, so it becomes the high-water mark:
+    #readers and the next compaction only list records from its day folder on
+    folder = records_folder(path)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    settled = now - datetime.timedelta(seconds=RECORD_SETTLE_TIME)
+    cutoff = f"{folder}/{settled:%Y-%m-%d}/{settled:%Y%m%dT%H%M%S%f}"
+    new_records = [(p, df) for p, df in cache.get_records(folder, skip=set(folded), after=through, parse=_table_parser(path)) if p < cutoff]
+    if manifest is not None and not new_records:
+        return False
+
+    frames = [] if base is None else [base]
+    frames += [df for p, df in new_records if df is not None]
+    if not frames:
+        return False
+    df = concat_tables(frames, table_schema(path))
+    df = _normalize_dtypes(df.loc[:, ~df.columns.str.contains('^Unnamed')], table_schema(path))
+
+    #snapshots are never overwritten, and the one before is kept until the next compaction,
+    #so a reader still holding the old manifest (up to TABLE_REVISION_TTL) finds its snapshot
+    snapshot = f"{snapshots_folder(path)}/{now:%Y%m%dT%H%M%S%f}.parquet"
+    parquet_buffer = BytesIO()
+    df.to_parquet(parquet_buffer, index=False, compression="zstd")
+    dbx.files_upload(parquet_buffer.getvalue(), snapshot, mode=dropbox.files.WriteMode("add"))
+
+    new_manifest = {
+        "snapshot": snapshot,
+        "previous": None if manifest is None else manifest["snapshot"],
+        "through": cutoff,
+        #folded records named after the mark, only left by manifests from before it existed
+        "records": [p for p in folded if p >= cutoff],
+        "rows": len(df),
+        "compacted_at": now.isoformat(),
+    }
+    if manifest_rev is None:
+        mode = dropbox.files.WriteMode("add")
+    else:
+        mode = dropbox.files.WriteMode("update", manifest_rev)
+
+    try:
+        metadata = dbx.files_upload(json.dumps(new_manifest).encode(), manifest_path(path), mode=mode)
+    except dropbox.exceptions.ApiError:
+        #another process compacted first, keep theirs and drop ours
+        dbx.files_delete_v2(snapshot)
+        return False
+
+    cache.put(manifest_path(path), metadata.rev, new_manifest)
+    #only the snapshot two compactions back is unused now
+    if manifest is not None and manifest.get("previous"):
+        try:
+            dbx.files_delete_v2(manifest["previous"])
+        except dropbox.exceptions.ApiError:
+            pass
+    return True
+
+
+class PeriodicTask:
+    """Background thread that periodically runs task(path) for some tables (compaction, csv export)"""
+
+    def __init__(self, task, paths, interval):
+        self.task = task
+        self.paths = paths
+        self.interval = interval
+        self.last_run = None
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            errors = []
+            for path in self.paths:
+                try:
+                    self.task(path)
+                except Exception as e: #keep going with the other tables and try again next round
+                    errors.append(f"{path}: {e}")
+            self.last_error = "; ".join(errors) or None
+            self.last_run = datetime.datetime.now()
+
+
+@st.cache_resource(show_spinner=False)
+def start_compactor(paths, interval=COMPACTION_INTERVAL):
+    """Start one compactor per server process for the given table paths (a tuple)"""
+    return PeriodicTask(compact_table, paths, interval)
+
+
+#___________________________________________________________________________________________________________________________________________
+# Plain csv export of compressed tables
+
+#how often a table kept as csv.gz or parquet is copied to its plain .csv path for the research team (seconds)
+CSV_EXPORT_INTERVAL = 3600
+
+#stored rev each table was last exported at, so an unchanged table isn't uploaded again
+_exported_revs = {}
+
+
+def export_csv(path):
+    """Write the table at path to path itself as plain csv when it is kept in another format, True if written"""
+    #a partitioned table is exported partition by partition, next to each partition's file
+    if partition_columns(path):
+        return any([export_csv(part) for part in list_partitions(path)])
+
+    stored = stored_path(path)
+    if stored == path:
+        return False
+
+    try:
+        metadata = get_dbx().files_get_metadata(stored)
+    except dropbox.exceptions.ApiError as e:
+        #nothing written in the new format yet, the .csv is still the table itself
+        if _is_not_found(e):
+            return False
+        raise
+    if _exported_revs.get(path) == metadata.rev:
+        return False
+
+    df, rev = get_table_cache().get_with_rev(stored, _table_parser(stored))
+    #straight to Dropbox, the export is never read back by the app so it stays out of the cache
+    get_dbx().files_upload(_serialize_table(df, path), path, mode=dropbox.files.WriteMode("overwrite"))
+    _exported_revs[path] = rev
+    return True
+
+
+@st.cache_resource(show_spinner=False)
+def start_csv_export(paths, interval=CSV_EXPORT_INTERVAL):
+    """Start one csv exporter per server process for the given table paths (a tuple), table mode only"""
+    #in records mode the .csv is the legacy table the snapshots are built on, it must not be overwritten
+    return PeriodicTask(export_csv, paths, interval)
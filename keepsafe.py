@@ -6,40 +6,24 @@
 #lauch from Streamlit cloud -> my apps
 
 #import modules
-import numpy as np
 import streamlit as st
-import pandas as pd 
-import random
-import string
 import datetime
 import os
-import dropbox
-from io import StringIO
-import requests
-
-app_key = st.secrets["dropbox"]["app_key"]
-app_secret = st.secrets["dropbox"]["app_secret"]
-refresh_token = st.secrets["dropbox"]["refresh_token"]
-
-def get_new_access_token(app_key, app_secret, refresh_token):
-    token_url = "https://api.dropboxapi.com/oauth2/token"
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    auth = (app_key, app_secret)
-
-    response = requests.post(token_url, data=data, auth=auth)
-    response.raise_for_status()
-    tokens = response.json()
-    return tokens["access_token"]
-
-# Initialize Dropbox client
-access_token = get_new_access_token(app_key, app_secret, refresh_token)
-dbx = dropbox.Dropbox(access_token)
+from dropbox_storage import get_storage_mode, get_table_format, start_compactor, start_csv_export
+from submission_queue import queue_row, submission_id, submission_seen, show_save_status
+from producer_registry import find_producer_id, new_producer_id, remember_producer, field_number_for, finish_field, FIELD_NUMBER_ERRORS
+from soil_uploads import upload_files, show_upload_report, pending_uploads, soil_test_number
+#answer options of the forms, shared with the table schemas (survey_schema.py)
+from survey_schema import (
+    SELECT_YES_NO, BLANK_YES_NO, ED_LEVEL_OPTIONS, FARM_PURPOSE_OPTIONS, CROP_PURPOSE_OPTIONS, FIELD_SIZE_UNIT_OPTIONS,
+    APPLIED_WITH_OPTIONS, IRR_DECISION_OPTIONS, IRR_TYPE_OPTIONS, WATER_SOURCE_OPTIONS,
+    KEEPSAFE_PREV_CROP_PURPOSE_OPTIONS, KEEPSAFE_YIELD_UNIT_OPTIONS, KEEPSAFE_SEED_SOURCE_OPTIONS, KEEPSAFE_SEED_TREAT_OPTIONS,
+    KEEPSAFE_SEED_RATE_UNIT_OPTIONS, KEEPSAFE_TILLAGE_OPTIONS, KEEPSAFE_APPLICATION_TIME_OPTIONS, KEEPSAFE_NUTRIENT_OPTIONS,
+    KEEPSAFE_MONTH_OPTIONS, KEEPSAFE_EARLY_LATE_OPTIONS,
+)
 
-# Use dbx here
-files = dbx.files_list_folder('').entries
+#Dropbox client is built lazily (dropbox_storage.get_dbx) the first time data is needed
+#(one pooled client per server process, its token is refreshed in the background)
 
 #___________________________________________________________________________________________________________________________________________
 #___________________________________________________________________________________________________________________________________________
@@ -54,6 +38,13 @@ field_FILE_PATH = "/streamlit/fields_info.csv"
 #folder to save soil test uploads
 soil_tests = "/streamlit/soiltest_uploads"
 
+#fold submission records into a parquet snapshot in the background (records storage mode only)
+if get_storage_mode() == "records":
+    start_compactor((producer_FILE_PATH, field_FILE_PATH))
+#tables kept compressed are copied to their .csv paths in the background for the research team
+elif get_table_format() != "csv":
+    start_csv_export((producer_FILE_PATH, field_FILE_PATH))
+
 #___________________________________________________________________________________________________________________________________________
 #___________________________________________________________________________________________________________________________________________
 
@@ -149,21 +140,14 @@ st.write(css, unsafe_allow_html=True)
 #============================================================================================================================================
 
 #define function to generate unique producer ID (use when submitted)
-def generate_unique_id(df, user_firstname, user_lastname):
+def generate_unique_id(user_firstname, user_lastname, user_email="", user_phone=""):
     """Generate a unique ID or use existing one"""
-    #check for existing same name
-    existing_row = df[(df['firstname'].str.lower() == user_firstname.lower()) & (df['lastname'].str.lower() == user_lastname.lower())]
-
-    #if found use same ID
-    if not existing_row.empty:
-        return existing_row.iloc[0]['producer_id']
-    else:
-        # else generate new ID
-        while True:
-            producer_id = ''.join(random.choices(string.digits, k=6)) 
-            # make sure ID doesn't already exist
-            if producer_id not in df['producer_id'].values:
-                return producer_id 
+    #returning producer with the same email, phone or name keeps their ID (see producer_registry)
+    producer_id = find_producer_id(producer_FILE_PATH, user_firstname, user_lastname, user_email, user_phone)
+    if producer_id is not None:
+        return producer_id
+    # else generate new ID
+    return new_producer_id(producer_FILE_PATH)
 
 #start with no producer ID in session state
 if 'producer_id' not in st.session_state:
@@ -200,30 +184,6 @@ new_data = {
 }
 expected_columns = list(new_data.keys())
 
-#read csv, populate fields if starting empty
-# Helper: Read CSV from Dropbox
-def read_csv_from_dropbox_safely(path, columns):
-    try:
-        metadata, res = dbx.files_download(path)
-        data = res.content.decode("utf-8").strip()  # Strip whitespace and newlines
-        
-        if not data:
-            return pd.DataFrame(columns=columns)
-
-        # Check that the first line contains headers
-        if ',' not in data.splitlines()[0]:
-            return pd.DataFrame(columns=columns)
-
-        df = pd.read_csv(StringIO(data))
-        return df
-    
-    except dropbox.exceptions.ApiError as e:
-        st.warning(f"Dropbox API error or file not found: {e}")
-        return pd.DataFrame(columns=columns)
-    
-    except pd.errors.EmptyDataError:
-        return pd.DataFrame(columns=columns)
-df = read_csv_from_dropbox_safely(producer_FILE_PATH, expected_columns)
 
 #---------------------------------------------------------------------------------------------------------------------------------------------------
 options_form = st.form("options_form", clear_on_submit = False) #create form, clear fields when data is submitted
@@ -252,8 +212,7 @@ with options_form:
 
     left, right = options_form.columns([2,3], vertical_alignment = "bottom")
     new_data['age'] = left.text_input("Age")
-    new_data['ed_level'] = right.selectbox("Highest Level of Completed Education",options = ("--","below highschool",
-                                "highschool","some college","associates degree","trade/vocational program","bachelors degree","postgraduate degree"))
+    new_data['ed_level'] = right.selectbox("Highest Level of Completed Education",options = ED_LEVEL_OPTIONS)
 
     #education source
     st.write('Primary Source of Information (select all that apply):')
@@ -336,7 +295,7 @@ with options_form:
 
 #define conditional placeholders for 'other' options 
 with farm_purpose:
-    selection2 = st.selectbox("Primary Purpose of Farm", options = ("--","Grain","Livestock","50/50","Other"))
+    selection2 = st.selectbox("Primary Purpose of Farm", options = FARM_PURPOSE_OPTIONS)
 with placeholder_2:
     if selection2 == "Other":
         purpose_other = st.text_input("Enter other purpose")
@@ -344,12 +303,6 @@ with placeholder_2:
 
 #if form 1 submitted:
 if add_data:
-    #use the producer ID function
-    new_data['producer_id'] = generate_unique_id(df, new_data['firstname'], new_data['lastname'])
-
-    #save producer ID into session state to take to the second form
-    st.session_state['producer_id'] = new_data['producer_id']
-
     #fill farm purpose with 'other'
     purpose_temp = ""
     if selection2 == "Other":
@@ -358,15 +311,20 @@ if add_data:
         purpose_temp = selection2
 
     new_data['farm_purpose'] = purpose_temp
- 
-    #add to end of csv
-    new_df = pd.DataFrame([new_data]) #dictionary to data frame
-    df = pd.concat([df, new_df], ignore_index=True) #append to csv
-    
-    # Save updated DataFrame to Dropbox
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False)
-    dbx.files_upload(csv_buffer.getvalue().encode(), producer_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+
+    #a replayed submit (double click, rerun) is already saved and gets no new ID, corrected answers are a new submission
+    producer_submission = submission_id("producer", new_data)
+    if not submission_seen(producer_submission):
+        #use the producer ID function
+        new_data['producer_id'] = generate_unique_id(new_data['firstname'], new_data['lastname'], new_data['email'], new_data['phone'])
+
+        #save producer ID into session state to take to the second form
+        st.session_state['producer_id'] = new_data['producer_id']
+
+        #add to end of csv in the background (or as its own record file, see dropbox_storage.append_row)
+        queue_row(producer_FILE_PATH, new_data, expected_columns, producer_submission)
+        #point their name, email and phone at the ID for next time
+        remember_producer(producer_FILE_PATH, new_data['producer_id'], new_data['firstname'], new_data['lastname'], new_data['email'], new_data['phone'])
 
     #Display updated file
     #st.write(df) 
@@ -387,6 +345,8 @@ if "form_submitted" not in st.session_state:
     st.session_state.form_submitted = False #start with field1 not submitted
 if "form2_visible" not in st.session_state:
     st.session_state.form2_visible = False  #start with field2 not visible
+if "field_form" not in st.session_state:
+    st.session_state.field_form = 1 #field form on screen, each "Add another field" shows a new one (a new submission)
 
 #dictionary
 new_data2 = {
@@ -549,8 +509,6 @@ for i in range(1, N_PRODUCTS + 1):
 
 #read csv, populate fields if starting empty
 columns = list(new_data2.keys())
-
-df2 = read_csv_from_dropbox_safely(field_FILE_PATH, columns)
 #-------------------------------------------------------------------------------------------------------------------------------------------------------
 # show the form if field 1 hasn't been submitted    
 if not st.session_state.form_submitted:
@@ -602,7 +560,7 @@ if not st.session_state.form_submitted:
             
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data2['field_size'] = left.text_input("Field Size")
-            new_data2['field_size_unit'] = right.selectbox("Unit", options = ("Acres","Hectares"))
+            new_data2['field_size_unit'] = right.selectbox("Unit", options = FIELD_SIZE_UNIT_OPTIONS)
         
             #crop purpose, allow other
             crop_purpose = st.empty()
@@ -614,8 +572,8 @@ if not st.session_state.form_submitted:
             new_data2['prev_crop'] = left.text_input("Previous Crop (ex: wheat)")
             new_data2['prev_crop_year'] = right.text_input("Harvest Year (ex: 2021)")
             
-            new_data2['prev_crop_purpose'] = right.selectbox("Previous Crop Purpose", options = ("Grain","Seed","Forage","Silage", "Other"))
-            new_data2['prev_crop_irr'] = st.radio("Did the previous crop receive irrigation?", options=("Select","yes", "no"), horizontal=True)
+            new_data2['prev_crop_purpose'] = right.selectbox("Previous Crop Purpose", options = KEEPSAFE_PREV_CROP_PURPOSE_OPTIONS)
+            new_data2['prev_crop_irr'] = st.radio("Did the previous crop receive irrigation?", options=SELECT_YES_NO, horizontal=True)
                         
 
         #------------------------------------------------------------------------------------------------#
@@ -637,31 +595,36 @@ if not st.session_state.form_submitted:
                 new_data2['N_soildepth'] = right.text_input("N measured at what depth?")
             
             # Uploading to Dropbox
-            if uploaded_files:
-                number = 0
+            # (files already sent this session are skipped, so reruns don't upload them again)
+            new_uploads = pending_uploads(uploaded_files)
+            if new_uploads:
                 producer_id = st.session_state.get("producer_id", None)
             
                 if not producer_id:
                     st.warning("Producer ID is missing. Cannot save uploaded files.")
                 else:
-                    for uploaded_file in uploaded_files:
-                        number += 1
+                    #same field number the field row gets on submit
+                    try:
+                        field_number = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id)
+                    except FIELD_NUMBER_ERRORS:
+                        #the files stay pending, the next rerun tries again
+                        st.warning("Could not number this field, soil test files were not saved yet. Please try again.")
+                    else:
+                        files_to_upload = []
+                        for uploaded_file in new_uploads:
+                            number = soil_test_number(f"{producer_id}_field{field_number}", uploaded_file)
             
-                        # Extract file extension
-                        file_extension = os.path.splitext(uploaded_file.name)[1]
+                            # Extract file extension
+                            file_extension = os.path.splitext(uploaded_file.name)[1]
             
-                        # New filename format
-                        new_filename = f"soiltest{number}_{producer_id}_field1{file_extension}"
-                        dropbox_path = f"{soil_tests}/{new_filename}"
+                            # New filename format
+                            new_filename = f"soiltest{number}_{producer_id}_field{field_number}{file_extension}"
+                            dropbox_path = f"{soil_tests}/{new_filename}"
+                            files_to_upload.append((uploaded_file, dropbox_path))
             
-                        # Upload file to Dropbox
-                        dbx.files_upload(
-                            uploaded_file.read(),
-                            dropbox_path,
-                            mode=dropbox.files.WriteMode("overwrite")
-                        )
-                    
-                    st.success(f"Uploaded {number} soil test file(s)")
+                        # Upload files to Dropbox (in parallel, committed together)
+                        results = upload_files(files_to_upload, st.progress(0.0, text="Uploading soil test file(s)"))
+                        show_upload_report(results)
 
         #------------------------------------------------------------------------------------------------#
             left, right = st.columns(2)
@@ -677,11 +640,11 @@ if not st.session_state.form_submitted:
             new_data2['cultivar'] = st.text_input("Cultivar Name (brand and number)")
 
             left,right = st.columns([2,1], vertical_alignment = "bottom")
-            new_data2['seed_source'] = left.selectbox("Seed Source", options = ("--","Saved","Certified", "Registered"))
-            new_data2['seed_cleaned'] = right.selectbox("If saved seed, was it cleaned?", options = ("--","yes","no"))
+            new_data2['seed_source'] = left.selectbox("Seed Source", options = KEEPSAFE_SEED_SOURCE_OPTIONS)
+            new_data2['seed_cleaned'] = right.selectbox("If saved seed, was it cleaned?", options = BLANK_YES_NO)
 
-            new_data2['seed_treat'] = st.selectbox("Seed Treatment?", options = ("--","None","Insecticide only","Fungicide only","Both"))
-            new_data2['tillage'] = st.selectbox("Tillage", options = ("No-till","Minimal","Full"))
+            new_data2['seed_treat'] = st.selectbox("Seed Treatment?", options = KEEPSAFE_SEED_TREAT_OPTIONS)
+            new_data2['tillage'] = st.selectbox("Tillage", options = KEEPSAFE_TILLAGE_OPTIONS)
             new_data2['profile_h20'] = st.text_input("Estimated profile water at planting (ft)")
 
         
@@ -689,7 +652,7 @@ if not st.session_state.form_submitted:
             
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data2['seeding_rate'] = left.text_input("Seeding Rate")
-            new_data2['seeding_rate_unit'] = right.selectbox("Seeding Rate Units", options = ("lbs/ac","seeds/ac"))
+            new_data2['seeding_rate_unit'] = right.selectbox("Seeding Rate Units", options = KEEPSAFE_SEED_RATE_UNIT_OPTIONS)
             
 
             st.markdown("<hr>", unsafe_allow_html=True)
@@ -747,13 +710,7 @@ if not st.session_state.form_submitted:
                     left, middle, right = st.columns(3, vertical_alignment="bottom")
                     new_data2[f"{i}_time"] = left.selectbox(
                         "Time of Application",
-                        options=(
-                            "pre-plant/at-drilling",
-                            "Fall",
-                            "Green-up",
-                            "Late season",
-                            "Post Harvest",
-                        ),
+                        options=KEEPSAFE_APPLICATION_TIME_OPTIONS,
                         key=f"{i}_time"
                     )
                     new_data2[f"{i}_date"] = middle.date_input(
@@ -766,12 +723,12 @@ if not st.session_state.form_submitted:
                         key=f"{i}_month"
                     )
                     new_data2[f"{i}_plus"] = st.radio("Nutrient applied with:?", 
-                                                      options=("None","Herbicide", "Fertigation", "Fungicide"), horizontal=True,
+                                                      options=APPLIED_WITH_OPTIONS, horizontal=True,
                                                      key=f"{i}_plus")
                     left, right = st.columns(2, vertical_alignment="bottom")
                     new_data2[f"{i}_nutrient_a"] = left.selectbox(
                         "Specific Nutrient",
-                        options=("N", "P", "K", "S", "Lime", "Micro"),
+                        options=KEEPSAFE_NUTRIENT_OPTIONS,
                         key=f"{i}_nutrient_a"
                     )
                     new_data2[f"{i}_nutrient_a_amnt"] = right.text_input(
@@ -782,7 +739,7 @@ if not st.session_state.form_submitted:
                     left, right = st.columns(2, vertical_alignment="bottom")
                     new_data2[f"{i}_nutrient_b"] = left.selectbox(
                         "Specific Nutrient",
-                        options=("N", "P", "K", "S", "Lime", "Micro"),
+                        options=KEEPSAFE_NUTRIENT_OPTIONS,
                         key=f"{i}_nutrient_b"
                     )
                     new_data2[f"{i}_nutrient_b_amnt"] = right.text_input(
@@ -793,7 +750,7 @@ if not st.session_state.form_submitted:
                     left, right = st.columns(2, vertical_alignment="bottom")
                     new_data2[f"{i}_nutrient_c"] = left.selectbox(
                         "Specific Nutrient",
-                        options=("N", "P", "K", "S", "Lime", "Micro"),
+                        options=KEEPSAFE_NUTRIENT_OPTIONS,
                         key=f"{i}_nutrient_c"
                     )
                     new_data2[f"{i}_nutrient_c_amnt"] = right.text_input(
@@ -809,7 +766,7 @@ if not st.session_state.form_submitted:
             "<small style='color:black;'>Fungicide Use? (if yes...)</small>",
             unsafe_allow_html=True
              )
-            new_data2['fung'] = st.radio("Was Fungicide Used?", options=("Select","yes", "no"), horizontal=True)
+            new_data2['fung'] = st.radio("Was Fungicide Used?", options=SELECT_YES_NO, horizontal=True)
         
             left, middle, right = st.columns(3, vertical_alignment = "bottom")
             new_data2['fungicide_freq'] = right.text_input("Rate", key="fung_freq")
@@ -820,7 +777,7 @@ if not st.session_state.form_submitted:
             "<small style='color:black;'>Insecticide Use? (if yes...)</small>",
             unsafe_allow_html=True
              )
-            new_data2['insect'] = st.radio("Was insecticide Used?", options=("Select","yes", "no"), horizontal=True)
+            new_data2['insect'] = st.radio("Was insecticide Used?", options=SELECT_YES_NO, horizontal=True)
 
         
             left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -833,7 +790,7 @@ if not st.session_state.form_submitted:
             "<small style='color:black;'>Herbicide Use? (if yes...)</small>",
             unsafe_allow_html=True
              )
-            new_data2['herb'] = st.radio("Was herbicide Used?", options=("Select","yes", "no"), horizontal=True)
+            new_data2['herb'] = st.radio("Was herbicide Used?", options=SELECT_YES_NO, horizontal=True)
 
         
             left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -846,7 +803,7 @@ if not st.session_state.form_submitted:
 
         
             #Irrigation    
-            new_data2['irrigated'] = st.radio("**Did this wheat crop receive irrigation?**", options=("Select","yes", "no"), horizontal=True)
+            new_data2['irrigated'] = st.radio("**Did this wheat crop receive irrigation?**", options=SELECT_YES_NO, horizontal=True)
  
             st.markdown("<hr>", unsafe_allow_html=True) 
             st.markdown("**Irrigation Management**")
@@ -856,8 +813,8 @@ if not st.session_state.form_submitted:
              )
             st.markdown("")
             new_data2['irr_shared']= st.text_input("Is the reported water supply shared with another crop? (*ex: half pivot was corn*)")
-            new_data2['irr_decision'] = st.selectbox("What drives your decision to trigger an irrigation event?", options = ("crop consultant", "moisture probes", "visual assessment", "consistent scheduled dates"))
-            new_data2['irr_type'] = st.selectbox("Irrigation Method", options = ("center pivot","drip","flood", "other")) 
+            new_data2['irr_decision'] = st.selectbox("What drives your decision to trigger an irrigation event?", options = IRR_DECISION_OPTIONS)
+            new_data2['irr_type'] = st.selectbox("Irrigation Method", options = IRR_TYPE_OPTIONS) 
 
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data2['system_config'] = left.text_input("Sprinkler Spacing")
@@ -867,10 +824,10 @@ if not st.session_state.form_submitted:
             
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data2['system_capacity'] = left.text_input("System Capacity (*gal/min*)")
-            new_data2['water_source'] = right.selectbox("Water source",options = ("Ground","Surface"))
+            new_data2['water_source'] = right.selectbox("Water source",options = WATER_SOURCE_OPTIONS)
         
             new_data2['capacity_flux'] = st.text_input("Does system capacity fluctuate throughout the season (*if yes, breifly explain*)")
-            new_data2['pre_plant_water'] = st.radio("Pre-plant water applied?", options = ("Select","yes","no"), horizontal=True)
+            new_data2['pre_plant_water'] = st.radio("Pre-plant water applied?", options = SELECT_YES_NO, horizontal=True)
             #new_data2['irr_number'] = st.text_input("Number of irrigation events throughout the season (*including pre-plant*)")
 
         #irrigation event 1
@@ -884,15 +841,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr1_date')  #use key to get around having identical widgets
                 new_data2['irr1_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr1_month')
-                new_data2['irr1_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr1_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr1_month')
+                new_data2['irr1_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr1_timing')
                 #new_data2['irr1_stage'] =st.text_input("Crop Stage at time of Irrigation", key ='irr1_stage' )
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr1_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr1_amount' )
                 new_data2['irr1_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr1_rate')
-                new_data2['irr1_fertigation'] = st.radio("Fertigation?", options = ("Select","yes","no"), 
+                new_data2['irr1_fertigation'] = st.radio("Fertigation?", options = SELECT_YES_NO, 
                                                          horizontal=True, key = 'irr1_fertigation')
 
             with st.expander("Second Application"):
@@ -902,15 +858,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr2_date')  #use key to get around having identical widgets
                 new_data2['irr2_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr2_month')
-                new_data2['irr2_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr2_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr2_month')
+                new_data2['irr2_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr2_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr2_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr2_amount' )
                 new_data2['irr2_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr2_rate')
                 new_data2['irr2_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr2_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr2_fertigation')
 
             with st.expander("Third Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -919,15 +874,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr3_date')  #use key to get around having identical widgets
                 new_data2['irr3_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr3_month')
-                new_data2['irr3_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr3_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr3_month')
+                new_data2['irr3_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr3_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr3_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr3_amount' )
                 new_data2['irr3_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr3_rate')
                 new_data2['irr3_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr3_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr3_fertigation')
 
             with st.expander("Fourth Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -936,15 +890,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr4_date')  #use key to get around having identical widgets
                 new_data2['irr4_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr4_month')
-                new_data2['irr4_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr4_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr4_month')
+                new_data2['irr4_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr4_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr4_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr4_amount' )
                 new_data2['irr4_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr4_rate')
                 new_data2['irr4_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr4_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr4_fertigation')
 
             with st.expander("Fifth Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -953,15 +906,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr5_date')  #use key to get around having identical widgets
                 new_data2['irr5_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr5_month')
-                new_data2['irr5_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr5_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr5_month')
+                new_data2['irr5_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr5_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr5_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr5_amount' )
                 new_data2['irr5_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr5_rate')
                 new_data2['irr5_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr5_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr5_fertigation')
 
             with st.expander("Sixth Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -970,15 +922,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr6_date')  #use key to get around having identical widgets
                 new_data2['irr6_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr6_month')
-                new_data2['irr6_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr6_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr6_month')
+                new_data2['irr6_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr6_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr6_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr6_amount' )
                 new_data2['irr6_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr6_rate')
                 new_data2['irr6_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr6_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr6_fertigation')
 
             with st.expander("Seventh Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -987,15 +938,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr7_date')  #use key to get around having identical widgets
                 new_data2['irr7_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr7_month')
-                new_data2['irr7_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr7_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr7_month')
+                new_data2['irr7_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr7_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr7_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr7_amount' )
                 new_data2['irr7_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr7_rate')
                 new_data2['irr7_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr7_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr7_fertigation')
 
             with st.expander("Eighth Application"):
                 left, middle, right = st.columns(3, vertical_alignment = "bottom")
@@ -1004,15 +954,14 @@ if not st.session_state.form_submitted:
                                                     max_value=datetime.date.today(),
                                                     key = 'irr8_date')  #use key to get around having identical widgets
                 new_data2['irr8_month'] = middle.selectbox("Irrigation Month", 
-                                                           options =("Jan","Feb","Mar","Apr","May",
-                                                                     "Jun","Jul","Aug","Sep","Oct","Nov","Dec"), key = 'irr8_month')
-                new_data2['irr8_timing'] = right.selectbox("Early or Late Month", options = ("early","late"), key = 'irr8_timing')
+                                                           options =KEEPSAFE_MONTH_OPTIONS, key = 'irr8_month')
+                new_data2['irr8_timing'] = right.selectbox("Early or Late Month", options = KEEPSAFE_EARLY_LATE_OPTIONS, key = 'irr8_timing')
                 
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data2['irr8_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr8_amount' )
                 new_data2['irr8_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr8_rate')
                 new_data2['irr8_fertigation'] = st.radio("Fertigation?", 
-                                                         options = ("Select","yes","no"), horizontal=True, key = 'irr8_fertigation')
+                                                         options = SELECT_YES_NO, horizontal=True, key = 'irr8_fertigation')
             
         
         
@@ -1037,7 +986,7 @@ if not st.session_state.form_submitted:
      #------------------------------------------------------------------------------------------------#
 #define other crop purpose
     with crop_purpose:
-        selection3 = st.selectbox("Primary Purpose of Wheat Crop", options = ("--","seed","grain","forage","dual-purpose","other"), key ='other1')
+        selection3 = st.selectbox("Primary Purpose of Wheat Crop", options = CROP_PURPOSE_OPTIONS, key ='other1')
     with placeholder_3:
         if selection3 == "other":
             crop_purpose_other = st.text_input("Enter other purpose", key = 'other2')
@@ -1045,7 +994,7 @@ if not st.session_state.form_submitted:
 
 #define other yield units
     with yield_unit:
-        selection = st.selectbox("Yield Unit",options = ("bu/ac","t/ha","lb/ac","kg/ha","other"), key = 'unit1')
+        selection = st.selectbox("Yield Unit",options = KEEPSAFE_YIELD_UNIT_OPTIONS, key = 'unit1')
     with placeholder_text:
         if selection == "other":
             otherOption = st.text_input("Enter other units", key = 'unit2')
@@ -1056,8 +1005,6 @@ if not st.session_state.form_submitted:
             st.session_state.form_submitted = True #field1 disapears
             st.session_state.form2_visible = True #field2 becomes visible
         
-            new_data2['field_number'] = 1 #always is the first submission
-        
             producer_id = st.session_state.get('producer_id', None) #take from where ID is created in form 1 and saved in session state
             if producer_id is None:
                     new_data2['producer_id'] = "error"
@@ -1084,19 +1031,20 @@ if not st.session_state.form_submitted:
             new_data2['crop_purpose'] = purpose_temp
     
             #add to csv
-                        
-            df2 = read_csv_from_dropbox_safely(field_FILE_PATH, columns)
-        
-            df2 = df2.loc[:, ~df2.columns.str.contains('^Unnamed')]  #to correct problems with unnamed columns
-        
-            new_df2 = pd.DataFrame([new_data2]) #dictionary to data frame
-
-            df2 = pd.concat([df2, new_df2], ignore_index=True) 
-                     
-            # Save updated DataFrame to Dropbox
-            csv_buffer2 = StringIO()
-            df2.to_csv(csv_buffer2, index=False)
-            dbx.files_upload(csv_buffer2.getvalue().encode(), field_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+            #a replayed submit (double click, rerun, Finish clicked again) was already saved, it isn't numbered or queued again
+            field_submission = submission_id(f"field_{st.session_state.field_form}")
+            if not submission_seen(field_submission):
+                if producer_id is not None:
+                    #the producer's next field number (the one the soil tests were named with)
+                    try:
+                        new_data2['field_number'] = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id)
+                    except FIELD_NUMBER_ERRORS:
+                        #the counter couldn't be reached, the row is still saved (without a field number)
+                        new_data2['field_number'] = ""
+                queue_row(field_FILE_PATH, new_data2, columns, field_submission)
+                finish_field(producer_id)
+            #the next field is filled in on a new form instance
+            st.session_state.field_form += 1
 
             placeholder.empty()  
             st.rerun() 
@@ -1105,8 +1053,6 @@ if not st.session_state.form_submitted:
 
 #finish       
     if finish:
-            new_data2['field_number'] = 1   
-
             #capture producer ID from form 1
             producer_id = st.session_state.get('producer_id', None)
             if producer_id is None:
@@ -1134,17 +1080,18 @@ if not st.session_state.form_submitted:
             new_data2['crop_purpose'] = purpose_temp
     
             #add to csv  
-            df2 = read_csv_from_dropbox_safely(field_FILE_PATH, columns)
-            df2 = df2.loc[:, ~df2.columns.str.contains('^Unnamed')]
-        
-            new_df2 = pd.DataFrame([new_data2]) #dictionary to data frame
-
-            df2 = pd.concat([df2, new_df2], ignore_index=True) 
-                    
-            # Save updated DataFrame to Dropbox
-            csv_buffer2 = StringIO()
-            df2.to_csv(csv_buffer2, index=False)
-            dbx.files_upload(csv_buffer2.getvalue().encode(), field_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+            #a replayed submit (double click, rerun, Finish clicked again) was already saved, it isn't numbered or queued again
+            field_submission = submission_id(f"field_{st.session_state.field_form}")
+            if not submission_seen(field_submission):
+                if producer_id is not None:
+                    #the producer's next field number (the one the soil tests were named with)
+                    try:
+                        new_data2['field_number'] = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id)
+                    except FIELD_NUMBER_ERRORS:
+                        #the counter couldn't be reached, the row is still saved (without a field number)
+                        new_data2['field_number'] = ""
+                queue_row(field_FILE_PATH, new_data2, columns, field_submission)
+                finish_field(producer_id)
             
             #st.write(df2)
 
@@ -1301,7 +1248,7 @@ if st.session_state.form2_visible:
             
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data3['field_size'] = left.text_input("Field Size", key = 'size2')
-            new_data3['field_size_unit'] = right.selectbox("Unit", options = ("Acres","Hectares"), key = 'sizeunit2')
+            new_data3['field_size_unit'] = right.selectbox("Unit", options = FIELD_SIZE_UNIT_OPTIONS, key = 'sizeunit2')
         
             #crop purpose
             crop_purpose = st.empty()
@@ -1313,7 +1260,7 @@ if st.session_state.form2_visible:
             new_data3['prev_crop'] = left.text_input("Previous Crop (ex: wheat)",key = 'prevcrop2')
             new_data3['prev_crop_year'] = right.text_input("Harvest Year (ex: 2021)", key = 'prevcropyear2')
 
-            new_data3['prev_crop_irr'] = st.radio("Did the previous crop receive irrigation?", options=("Select","yes", "no"), 
+            new_data3['prev_crop_irr'] = st.radio("Did the previous crop receive irrigation?", options=SELECT_YES_NO, 
                                                   horizontal=True, key = 'previrr2')
                         
 
@@ -1336,41 +1283,33 @@ if st.session_state.form2_visible:
                 new_data3['N_soil'] = left.text_input("Nitrogen (Nitrate (NO3) ppm or N/acre)", key='n2')
                 new_data3['N_soildepth'] = right.text_input("N measured at what depth?", key='ndepth2')
             
-            # Handle uploads
-            if uploaded_files:
-                number = 0
-            
-                # Safely read fields_info.csv from Dropbox
-                df2 = read_csv_from_dropbox_safely(field_FILE_PATH, list(new_data3.keys()))
-                
-                # Determine next field number
-                if not df2.empty and 'field_number' in df2.columns:
-                    last_field_numbertemp = df2['field_number'].iloc[-1]
-                else:
-                    last_field_numbertemp = 0
-            
-                field_numbtemp = int(last_field_numbertemp) + 1
-            
+            # Handle uploads (files already sent this session are skipped, so reruns don't read or upload anything)
+            new_uploads = pending_uploads(uploaded_files)
+            if new_uploads:
                 producer_id2 = st.session_state.get("producer_id", None)
                 if producer_id2 is None:
                     st.warning("Producer ID not found in session state.")
                 else:
-                    for uploaded_file in uploaded_files:
-                        number += 1
-                        file_extension = os.path.splitext(uploaded_file.name)[1]
-                        new_filename = f"soiltest{number}_{producer_id2}_field{field_numbtemp}{file_extension}"
+                    # Next field number of this producer (the field row gets the same one)
+                    try:
+                        field_numbtemp = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id2)
+                    except FIELD_NUMBER_ERRORS:
+                        #the files stay pending, the next rerun tries again
+                        st.warning("Could not number this field, soil test files were not saved yet. Please try again.")
+                    else:
+                        files_to_upload = []
+                        for uploaded_file in new_uploads:
+                            number = soil_test_number(f"{producer_id2}_field{field_numbtemp}", uploaded_file)
+                            file_extension = os.path.splitext(uploaded_file.name)[1]
+                            new_filename = f"soiltest{number}_{producer_id2}_field{field_numbtemp}{file_extension}"
             
-                        # Define Dropbox path
-                        dropbox_path = f"/streamlit/soiltest_uploads/{new_filename}"
+                            # Define Dropbox path
+                            dropbox_path = f"/streamlit/soiltest_uploads/{new_filename}"
+                            files_to_upload.append((uploaded_file, dropbox_path))
             
-                        # Upload file to Dropbox
-                        dbx.files_upload(
-                            uploaded_file.read(),
-                            dropbox_path,
-                            mode=dropbox.files.WriteMode("overwrite")
-                        )
-            
-                    st.success(f"Uploaded soil test file(s)")
+                        # Upload files to Dropbox (in parallel, committed together)
+                        results = upload_files(files_to_upload, st.progress(0.0, text="Uploading soil test file(s)"))
+                        show_upload_report(results)
         #------------------------------------------------------------------------------------------------#
 
             left, right = st.columns(2)
@@ -1384,10 +1323,10 @@ if st.session_state.form2_visible:
             new_data3['cultivar'] = st.text_input("Cultivar Name (brand and number)", key = 'cultivar2')
 
             left,right = st.columns([2,1], vertical_alignment = "bottom")
-            new_data3['seed_source'] = left.selectbox("Seed Source", options = ("--","Saved","Certified"), key = 'seedsource2')
-            new_data3['seed_cleaned'] = right.selectbox("If saved seed, was it cleaned?", options = ("--","yes","no"), key = 'seedclean2')
+            new_data3['seed_source'] = left.selectbox("Seed Source", options = KEEPSAFE_SEED_SOURCE_OPTIONS[:3], key = 'seedsource2')
+            new_data3['seed_cleaned'] = right.selectbox("If saved seed, was it cleaned?", options = BLANK_YES_NO, key = 'seedclean2')
 
-            new_data3['seed_treat'] = st.selectbox("Seed Treatment?", options = ("--","None","Insecticide only","Fungicide only","Both"), key = 'seedtreat2')
+            new_data3['seed_treat'] = st.selectbox("Seed Treatment?", options = KEEPSAFE_SEED_TREAT_OPTIONS, key = 'seedtreat2')
 
             new_data3['profile_h20'] = st.text_input("Estimated profile water at planting (ft)", key = 'profile2')
 
@@ -1396,7 +1335,7 @@ if st.session_state.form2_visible:
             
             left, right = st.columns(2, vertical_alignment = "bottom")
             new_data3['seeding_rate'] = left.text_input("Seeding Rate", key = 'seedingrate2')
-            new_data3['seeding_rate_unit'] = right.selectbox("Seeding Rate Units", options = ("lbs/ac","seeds/ac"), key = 'rateunit2')
+            new_data3['seeding_rate_unit'] = right.selectbox("Seeding Rate Units", options = KEEPSAFE_SEED_RATE_UNIT_OPTIONS, key = 'rateunit2')
             
 
             st.markdown("<hr>", unsafe_allow_html=True)
@@ -1494,7 +1433,7 @@ if st.session_state.form2_visible:
 
                 #------------------------------------------------------------------------------------------------#
             #Irrigation    
-            new_data2['irrigated'] = st.radio("Did this wheat crop receive irrigation?", options=("Select","yes", "no"), horizontal=True)
+            new_data2['irrigated'] = st.radio("Did this wheat crop receive irrigation?", options=SELECT_YES_NO, horizontal=True)
  
             st.markdown("<hr>", unsafe_allow_html=True) 
             st.markdown("**Irrigation Management**")
@@ -1513,7 +1452,7 @@ if st.session_state.form2_visible:
             new_data3['water_source'] = right.text_input("Water source (*i.e. ground, surface*)", key = 'source2')
         
             new_data3['capacity_flux'] = st.text_input("Does system capacity fluctuate throughout the season (*if yes, breifly explain*)", key = 'capacflux2')
-            new_data3['pre_plant_water'] = st.radio("Pre-plant water applied?", options = ("Select","yes","no"), horizontal=True, key = 'preplant2')
+            new_data3['pre_plant_water'] = st.radio("Pre-plant water applied?", options = SELECT_YES_NO, horizontal=True, key = 'preplant2')
             new_data3['irr_number'] = st.text_input("Number of irrigation events throughout the season (*including pre-plant*)", key = 'irrnumb2')
 
             #irrigation event 1
@@ -1527,7 +1466,7 @@ if st.session_state.form2_visible:
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data3['irr1_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr1_amount2' )
                 new_data3['irr1_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr1_rate2')
-                new_data3['irr1_fertigation'] = st.radio("Fertigation?", options = ("Select","yes","no"), horizontal=True, key = 'irr1_fertigation2')
+                new_data3['irr1_fertigation'] = st.radio("Fertigation?", options = SELECT_YES_NO, horizontal=True, key = 'irr1_fertigation2')
 
             with st.expander("Second Application  "):
                 new_data3['irr2_date'] =st.date_input("Irrigation Date", key = 'irr2_date2')
@@ -1536,7 +1475,7 @@ if st.session_state.form2_visible:
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data3['irr2_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr2_amount2' )
                 new_data3['irr2_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr2_rate2')
-                new_data3['irr2_fertigation'] = st.radio("Fertigation?", options = ("Select","yes","no"), horizontal=True, key = 'irr2_fertigation2')
+                new_data3['irr2_fertigation'] = st.radio("Fertigation?", options = SELECT_YES_NO, horizontal=True, key = 'irr2_fertigation2')
 
             with st.expander("Third Application  "):
                 new_data3['irr3_date'] =st.date_input("Irrigation Date", key = 'irr3_date2')
@@ -1545,7 +1484,7 @@ if st.session_state.form2_visible:
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data3['irr3_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr3_amount2' )
                 new_data3['irr3_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr3_rate2')
-                new_data3['irr3_fertigation'] = st.radio("Fertigation?", options = ("Select","yes","no"), horizontal=True, key = 'irr3_fertigation2')
+                new_data3['irr3_fertigation'] = st.radio("Fertigation?", options = SELECT_YES_NO, horizontal=True, key = 'irr3_fertigation2')
 
             with st.expander("Fourth Application  "):
                 new_data3['irr4_date'] =st.date_input("Irrigation Date", key = 'irr4_date2')
@@ -1554,7 +1493,7 @@ if st.session_state.form2_visible:
                 left, right = st.columns(2,vertical_alignment = "bottom")
                 new_data3['irr4_amount'] =left.text_input("Amount of water applied (*gals*)", key ='irr4_amount2' )
                 new_data3['irr4_rate'] =right.text_input("Rate of application (*gal/min*)", key = 'irr4_rate2')
-                new_data3['irr4_fertigation'] = st.radio("Fertigation?", options = ("Select","yes","no"), horizontal=True, key = 'irr4_fertigation2')
+                new_data3['irr4_fertigation'] = st.radio("Fertigation?", options = SELECT_YES_NO, horizontal=True, key = 'irr4_fertigation2')
 
               #submit buttons
             submit2 = st.form_submit_button("Add another field", type = "primary") #type controls the look
@@ -1573,7 +1512,7 @@ if st.session_state.form2_visible:
 #---------------------------------------------------------------------------------------
 #define other crop purpose
     with crop_purpose:
-        selection3 = st.selectbox("Primary Purpose of Wheat Crop", options = ("--","seed","grain","forage","dual-purpose","other"), key = 'select3')
+        selection3 = st.selectbox("Primary Purpose of Wheat Crop", options = CROP_PURPOSE_OPTIONS, key = 'select3')
     with placeholder_3:
         if selection3 == "other":
             crop_purpose_other = st.text_input("Enter other purpose", key = 'purp3')
@@ -1581,7 +1520,7 @@ if st.session_state.form2_visible:
 
 #define other yield units
     with yield_unit:
-        selection2 = st.selectbox("Yield Unit",options = ("bu/ac","t/ha","lb/ac","kg/ha","other"), key = 'selection3')
+        selection2 = st.selectbox("Yield Unit",options = KEEPSAFE_YIELD_UNIT_OPTIONS, key = 'selection3')
     with placeholder_text:
         if selection2 == "other":
             otherOption2 = st.text_input("Enter other units", key = 'other2')
@@ -1589,12 +1528,6 @@ if st.session_state.form2_visible:
 
 #add data       
     if submit2:
-        #grab last field number from above csv line and add 1
-            df2 = read_csv_from_dropbox_safely(field_FILE_PATH, columns) #need to call it here
-            df2 = df2.loc[:, ~df2.columns.str.contains('^Unnamed')] #remove filler columns
-            last_field_number = df2['field_number'].iloc[-1] if not df2.empty else 0
-            new_data3['field_number'] = last_field_number + 1
-        
         #producer ID from session state
             producer_id = st.session_state.get('producer_id', None)
             if producer_id is None:
@@ -1622,15 +1555,20 @@ if st.session_state.form2_visible:
             new_data3['crop_purpose'] = purpose_temp2
     
             #add to csv
-            
-            new_df3 = pd.DataFrame([new_data3]) #dictionary to data frame
-
-            df2 = pd.concat([df2, new_df3], ignore_index=True) 
-            
-            # Save updated DataFrame to Dropbox
-            csv_buffer2 = StringIO()
-            df2.to_csv(csv_buffer2, index=False)
-            dbx.files_upload(csv_buffer2.getvalue().encode(), field_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+            #a replayed submit (double click, rerun, Finish clicked again) was already saved, it isn't numbered or queued again
+            field_submission = submission_id(f"field_{st.session_state.field_form}")
+            if not submission_seen(field_submission):
+                if producer_id is not None:
+                    #the producer's next field number (the one the soil tests were named with)
+                    try:
+                        new_data3['field_number'] = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id)
+                    except FIELD_NUMBER_ERRORS:
+                        #the counter couldn't be reached, the row is still saved (without a field number)
+                        new_data3['field_number'] = ""
+                queue_row(field_FILE_PATH, new_data3, columns, field_submission)
+                finish_field(producer_id)
+            #the next field is filled in on a new form instance
+            st.session_state.field_form += 1
 
             placeholder.empty()  
             st.rerun() 
@@ -1639,12 +1577,6 @@ if st.session_state.form2_visible:
 
 #finish       
     if finish2:
-            #grab last field number and add 1
-            df2 = read_csv_from_dropbox_safely(field_FILE_PATH, columns)
-            df2 = df2.loc[:, ~df2.columns.str.contains('^Unnamed')]
-                
-            last_field_number = df2['field_number'].iloc[-1] if not df2.empty else 0
-            new_data3['field_number'] = last_field_number + 1
         #producer ID from session state
             producer_id = st.session_state.get('producer_id', None)
             if producer_id is None:
@@ -1672,14 +1604,18 @@ if st.session_state.form2_visible:
             new_data3['crop_purpose'] = purpose_temp2
     
             #add to csv
-            new_df3 = pd.DataFrame([new_data3]) #dictionary to data frame
-
-            df2 = pd.concat([df2, new_df3], ignore_index=True) 
-            
-            # Save updated DataFrame to Dropbox
-            csv_buffer2 = StringIO()
-            df2.to_csv(csv_buffer2, index=False)
-            dbx.files_upload(csv_buffer2.getvalue().encode(), field_FILE_PATH, mode=dropbox.files.WriteMode("overwrite"))
+            #a replayed submit (double click, rerun, Finish clicked again) was already saved, it isn't numbered or queued again
+            field_submission = submission_id(f"field_{st.session_state.field_form}")
+            if not submission_seen(field_submission):
+                if producer_id is not None:
+                    #the producer's next field number (the one the soil tests were named with)
+                    try:
+                        new_data3['field_number'] = field_number_for(field_FILE_PATH, producer_FILE_PATH, producer_id)
+                    except FIELD_NUMBER_ERRORS:
+                        #the counter couldn't be reached, the row is still saved (without a field number)
+                        new_data3['field_number'] = ""
+                queue_row(field_FILE_PATH, new_data3, columns, field_submission)
+                finish_field(producer_id)
 
             placeholder.empty()  
             #st.rerun() 
@@ -1687,6 +1623,5 @@ if st.session_state.form2_visible:
             #Display updated file
             #st.write(df2) 
 
-
-
-
+#let the respondent know if submissions are still being saved
+show_save_status()
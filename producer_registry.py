@@ -0,0 +1,240 @@
+#==================================================================================================================================
+#Producer registry
+#==================================================================================================================================
+#returning producers are recognised by name, email or phone through a small index kept next to the producers table
+#(/streamlit/indexes/producers_info.json, normalized key -> producer_id), so a lookup is a dict hit instead of a table scan
+#the index is read through the shared table cache (once per process, rev-checked), new keys go through the submission spool
+#new producer IDs are handed out from blocks each server process reserves from a counter next to the index (hi/lo)
+#field numbers count up per producer, one small counter file each (/streamlit/indexes/fields_info/<producer_id>.json)
+
+#import modules
+import os
+import re
+import threading
+import dropbox
+import streamlit as st
+from dropbox_storage import read_json, update_json, read_table_strict
+from submission_queue import queue_row, draft_row, get_submission_writer, read_table
+
+#producer table columns the index is built from
+IDENTITY_COLUMNS = ["firstname", "lastname", "email", "phone", "producer_id"]
+
+#fields table columns the field counters are seeded from
+FIELD_COUNTER_COLUMNS = ["producer_id", "field_number"]
+
+#a field counter that can't be reached (conflicts past WRITE_MAX_ATTEMPTS, Dropbox or network down), submit handlers catch
+#these and save the row anyway
+FIELD_NUMBER_ERRORS = (dropbox.exceptions.DropboxException, OSError)
+
+#producer IDs a process reserves from the counter at a time, IDs left in a block when the process stops are never used
+ID_BLOCK_SIZE = 50
+
+
+def index_path(path):
+    """Index of the producers table at path, /streamlit/producers_info.csv -> /streamlit/indexes/producers_info.json"""
+    folder, name = path.rsplit("/", 1)
+    return f"{folder}/indexes/{os.path.splitext(name)[0]}.json"
+
+
+def counter_path(path):
+    """ID counter of the producers table at path, /streamlit/producers_info.csv -> /streamlit/indexes/producers_info_ids.json"""
+    return f"{os.path.splitext(index_path(path))[0]}_ids.json"
+
+
+def _text(value):
+    #blank cells come back as NaN
+    return value.strip() if isinstance(value, str) else ""
+
+
+def identity_keys(firstname, lastname, email="", phone=""):
+    """Index keys for a producer, most specific first: email, phone, then first + last name"""
+    keys = []
+    email = _text(email).casefold()
+    if "@" in email:
+        keys.append(f"email:{email}")
+
+    #digits only, a leading US country code dropped
+    digits = re.sub(r"\D", "", _text(phone))
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    if len(digits) >= 7:
+        keys.append(f"phone:{digits}")
+
+    if _text(firstname) and _text(lastname):
+        keys.append("name:" + " ".join(f"{_text(firstname)} {_text(lastname)}".casefold().split()))
+    return keys
+
+
+def build_index(producers_path):
+    """Index every producer in the table (the first producer with a key keeps it) and store it"""
+    #the index is kept for good, so a failed read raises rather than storing an empty one
+    df = read_table_strict(producers_path, IDENTITY_COLUMNS, usecols=IDENTITY_COLUMNS)
+    built = {}
+    for row in df.itertuples(index=False):
+        row = row._asdict()
+        producer_id = _text(row.get("producer_id"))
+        if not producer_id:
+            continue
+        for key in identity_keys(row.get("firstname"), row.get("lastname"), row.get("email"), row.get("phone")):
+            built.setdefault(key, producer_id)
+
+    #another process may have built it meanwhile, keep what is there
+    def merge(store):
+        for key, producer_id in built.items():
+            store.setdefault(key, producer_id)
+        return store
+    return update_json(index_path(producers_path), merge)
+
+
+def load_index(producers_path):
+    """Producer index (key -> producer_id), including keys still waiting in the spool"""
+    path = index_path(producers_path)
+    index = read_json(path)
+    if index is None:
+        index = build_index(producers_path)
+
+    pending = get_submission_writer().pending_rows(path)
+    if pending:
+        index = dict(index)
+        for row in pending:
+            index.update(row)
+    return index
+
+
+def find_producer_id(producers_path, firstname, lastname, email="", phone=""):
+    """producer_id of a returning producer with the same email, phone or name, None for someone new"""
+    index = load_index(producers_path)
+    for key in identity_keys(firstname, lastname, email, phone):
+        if key in index:
+            return index[key]
+    return None
+
+
+def new_producer_id(producers_path):
+    """A six digit ID no producer has yet"""
+    return get_id_allocator(producers_path).allocate()
+
+
+def remember_producer(producers_path, producer_id, firstname, lastname, email="", phone="", draft=False):
+    """Point the producer's name, email and phone at producer_id (keys already taken keep their producer)"""
+    #draft holds the keys with the session's draft, so they are saved with the producer row on Finish
+    index = load_index(producers_path)
+    new_keys = {key: producer_id for key in identity_keys(firstname, lastname, email, phone) if key not in index}
+    if not new_keys:
+        return
+    if draft:
+        draft_row(index_path(producers_path), new_keys, [])
+    else:
+        queue_row(index_path(producers_path), new_keys, [])
+
+
+#___________________________________________________________________________________________________________________________________________
+# ID allocation
+
+class IdAllocator:
+    """Hands out producer IDs from blocks reserved in the counter file, no two processes get the same block"""
+
+    def __init__(self, path, block_size=ID_BLOCK_SIZE, taken=()):
+        self.path = path
+        self.block_size = block_size
+        self.taken = frozenset(taken)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def allocate(self):
+        """Next ID of this process's block as six digits (seven once the counter passes 999999)"""
+        with self._lock:
+            while True:
+                if self._next >= self._end:
+                    block = self._reserve()
+                    self._next = block * self.block_size
+                    self._end = self._next + self.block_size
+                producer_id = f"{self._next:06d}"
+                self._next += 1
+                if producer_id not in self.taken:
+                    return producer_id
+
+    def _reserve(self):
+        #rev-checked read-modify-write, a process that loses the race re-reads and takes the next block
+        def take(store):
+            block = store.get("next_block", 0)
+            store["next_block"] = block + 1
+            return block
+        return update_json(self.path, take)
+
+
+@st.cache_resource(show_spinner=False)
+def get_id_allocator(producers_path):
+    """One ID allocator per server process and producers table"""
+    #IDs from before the allocator were random, they are read once here and skipped, every later ID comes from a block
+    #(all of the table's IDs, a producer without a name, email or phone has no index key)
+    df = read_table_strict(producers_path, ["producer_id"], usecols=["producer_id"])
+    return IdAllocator(counter_path(producers_path), taken={_text(p) for p in df["producer_id"]} - {""})
+
+
+#___________________________________________________________________________________________________________________________________________
+# Field numbers
+
+def field_counter_path(fields_path, producer_id):
+    """Field counter of one producer, /streamlit/fields_info.csv -> /streamlit/indexes/fields_info/<producer_id>.json"""
+    return f"{os.path.splitext(index_path(fields_path))[0]}/{producer_id}.json"
+
+
+def last_field_number(fields_path, producer_id):
+    """The producer's highest field_number in the fields table (rows still in the spool included), 0 if none"""
+    #a partitioned table is read from the producer's bucket only
+    df = read_table(fields_path, FIELD_COUNTER_COLUMNS, usecols=FIELD_COUNTER_COLUMNS, producer_ids=[producer_id])
+    last = 0
+    for row_producer_id, field_number in zip(df["producer_id"], df["field_number"]):
+        if _text(row_producer_id) != producer_id:
+            continue
+        try:
+            last = max(last, int(field_number))
+        except (TypeError, ValueError):
+            continue
+    return last
+
+
+def reserve_field_numbers(fields_path, producers_path, producer_id, count=1):
+    """Reserve the producer's next count field numbers and return the first, no two calls get the same ones"""
+    #only this producer's counter is read and rewritten, submits for different producers never conflict
+    path = field_counter_path(fields_path, producer_id)
+
+    #an ID from the allocator has no fields yet, only a legacy producer's first counter starts after their rows in the
+    #table, worked out once here and not on every retry of the write
+    seed = 0
+    if producer_id in get_id_allocator(producers_path).taken and read_json(path) is None:
+        seed = last_field_number(fields_path, producer_id)
+
+    def take(store):
+        first = store.get("last", seed) + 1
+        store["last"] = first + count - 1
+        return first
+    return update_json(path, take)
+
+
+def number_draft_fields(fields_path, producers_path, items):
+    """Give drafted field rows the producer's next field numbers in draft order, one counter write per producer"""
+    rows = {}
+    for path, row, _, _ in items:
+        if path == fields_path and row.get("producer_id"):
+            rows.setdefault(row["producer_id"], []).append(row)
+    for producer_id, producer_rows in rows.items():
+        first = reserve_field_numbers(fields_path, producers_path, producer_id, len(producer_rows))
+        for offset, row in enumerate(producer_rows):
+            row["field_number"] = first + offset
+
+
+def field_number_for(fields_path, producers_path, producer_id):
+    """Number of the field this session is filling in, reserved the first time it is asked for"""
+    #the soil test names and the field row both need it, so it is kept until finish_field
+    reserved = st.session_state.setdefault("field_numbers", {})
+    if producer_id not in reserved:
+        reserved[producer_id] = reserve_field_numbers(fields_path, producers_path, producer_id)
+    return reserved[producer_id]
+
+
+def finish_field(producer_id):
+    """The field row was saved, the producer's next field gets a new number"""
+    st.session_state.get("field_numbers", {}).pop(producer_id, None)
@@ -0,0 +1,272 @@
+#==================================================================================================================================
+#Soil test uploads
+#==================================================================================================================================
+#files from st.file_uploader are sent to Dropbox in fixed-size chunks through upload sessions,
+#so only one chunk per file is copied at a time however big the scan or photo is
+#the files of one submission upload in parallel and are committed together with one finish_batch call
+#each file is sent once per session, later reruns with the same files still attached do nothing
+#bytes are stored once by content hash (blobs/), each field's soiltest name is a small json manifest pointing at its blob
+
+#import modules
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import dropbox
+import streamlit as st
+from dropbox_storage import get_dbx
+
+#bytes read from the uploader and sent per request
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+#files uploading at the same time
+UPLOAD_WORKERS = 4
+
+#attempts per chunk before the file is given up
+CHUNK_MAX_ATTEMPTS = 4
+
+#first retry of a chunk waits about this long (seconds), doubled on every attempt
+CHUNK_RETRY_DELAY = 0.5
+
+#block size of Dropbox's content_hash
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+#___________________________________________________________________________________________________________________________________________
+# Upload-once tracking
+
+def dropbox_content_hash(uploaded_file):
+    """Dropbox content_hash of a file: sha256 over the sha256 of every 4 MiB block"""
+    uploaded_file.seek(0)
+    overall = hashlib.sha256()
+    while True:
+        block = uploaded_file.read(HASH_BLOCK_SIZE)
+        if not block:
+            break
+        overall.update(hashlib.sha256(block).digest())
+    uploaded_file.seek(0)
+    return overall.hexdigest()
+
+
+def fingerprint(uploaded_file):
+    """(file id, size, content hash) of an attached file, hashed only once per session"""
+    hashes = st.session_state.setdefault("soil_test_hashes", {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = dropbox_content_hash(uploaded_file)
+    return (uploaded_file.file_id, uploaded_file.size, hashes[uploaded_file.file_id])
+
+
+def pending_uploads(uploaded_files):
+    """Attached files not sent yet this session"""
+    sent = st.session_state.setdefault("soil_tests_sent", {})
+    return [f for f in uploaded_files or [] if fingerprint(f) not in sent]
+
+
+def soil_test_number(field, uploaded_file):
+    """Number of an attached file among a field's soil tests (the n in soiltest{n}), counting up from 1"""
+    #kept per file for the session and never handed out twice, so a file attached after a sent one was
+    #removed gets a new number instead of the removed file's name (and overwriting its manifest)
+    numbers = st.session_state.setdefault("soil_test_numbers", {}).setdefault(field, {})
+    key = fingerprint(uploaded_file)
+    if key not in numbers:
+        numbers[key] = len(numbers) + 1
+    return numbers[key]
+
+
+#___________________________________________________________________________________________________________________________________________
+# Uploading
+
+
+def _with_retry(send, chunk_end):
+    """Send one chunk, retrying transient failures"""
+    for attempt in range(CHUNK_MAX_ATTEMPTS):
+        try:
+            return send()
+        except dropbox.exceptions.ApiError as e:
+            #the previous try reached Dropbox even though we didn't hear back
+            if _already_appended(e, chunk_end):
+                return None
+            if attempt == CHUNK_MAX_ATTEMPTS - 1:
+                raise
+        except (dropbox.exceptions.InternalServerError, dropbox.exceptions.RateLimitError, OSError):
+            if attempt == CHUNK_MAX_ATTEMPTS - 1:
+                raise
+        time.sleep(CHUNK_RETRY_DELAY * 2 ** attempt)
+
+
+def _already_appended(e, chunk_end):
+    error = e.error
+    if not isinstance(error, dropbox.files.UploadSessionAppendError) or not error.is_incorrect_offset():
+        return False
+    return error.get_incorrect_offset().correct_offset == chunk_end
+
+
+def _upload_to_session(dbx, uploaded_file, on_sent):
+    """Send every chunk of a file to a new upload session and close it, returns the session cursor"""
+    size = uploaded_file.size
+    uploaded_file.seek(0)
+
+    chunk = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+    session = _with_retry(lambda: dbx.files_upload_session_start(chunk, close=len(chunk) >= size), len(chunk))
+    cursor = dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=len(chunk))
+    on_sent(len(chunk))
+
+    while cursor.offset < size:
+        chunk = uploaded_file.read(UPLOAD_CHUNK_SIZE)
+        chunk_end = cursor.offset + len(chunk)
+        #the last chunk closes the session so it can be committed in the batch
+        _with_retry(lambda: dbx.files_upload_session_append_v2(chunk, cursor, close=chunk_end >= size), chunk_end)
+        cursor.offset = chunk_end
+        on_sent(len(chunk))
+
+    return cursor
+
+
+def blob_path(dropbox_path, content_hash):
+    """Where a file's bytes are stored: blobs/<content hash><ext> next to the name it was uploaded as"""
+    folder, name = dropbox_path.rsplit("/", 1)
+    return f"{folder}/blobs/{content_hash}{os.path.splitext(name)[1].lower()}"
+
+
+def manifest_path(dropbox_path):
+    """Small json that points the per-field name (soiltest{n}_{producer_id}_field{m}) at its blob"""
+    return f"{os.path.splitext(dropbox_path)[0]}.json"
+
+
+def _stored_hash(dbx, path):
+    """content_hash of the file at path, None if there is no file there"""
+    try:
+        return dbx.files_get_metadata(path).content_hash
+    except dropbox.exceptions.ApiError:
+        return None
+
+
+def upload_files(files, progress=None):
+    """Store (uploaded_file, dropbox_path) pairs by content hash, uploading in parallel and committing in one batch"""
+    #returns one dict per file with name, path, file, ok, deduplicated, error and seconds, progress is an optional st.progress bar
+    dbx = get_dbx()
+    results = []
+    for f, path in files:
+        content_hash = fingerprint(f)[2]
+        results.append({
+            "name": f.name, "path": path, "file": f, "content_hash": content_hash, "blob": blob_path(path, content_hash),
+            "ok": False, "deduplicated": False, "error": None, "seconds": 0.0,
+        })
+
+    #the same report attached to several fields (or twice here) is stored once
+    blobs = {}
+    for r in results:
+        blobs.setdefault(r["blob"], r)
+
+    total = sum(r["file"].size for r in blobs.values()) or 1
+    sent = [0]
+    sent_lock = threading.Lock()
+
+    def on_sent(n):
+        with sent_lock:
+            sent[0] += n
+
+    def store_blob(r):
+        """Cursor of the uploaded blob, None if Dropbox already has it (nothing is sent)"""
+        started = time.monotonic()
+        if _stored_hash(dbx, r["blob"]) == r["content_hash"]:
+            on_sent(r["file"].size)
+            return None, time.monotonic() - started
+        cursor = _upload_to_session(dbx, r["file"], on_sent)
+        return cursor, time.monotonic() - started
+
+    def store_manifest(r):
+        manifest = json.dumps({
+            "blob": r["blob"],
+            "content_hash": r["content_hash"],
+            "original_name": r["name"],
+            "size": r["file"].size,
+        }).encode()
+        session = _with_retry(lambda: dbx.files_upload_session_start(manifest, close=True), len(manifest))
+        return dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=len(manifest))
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        blob_futures = {blob: pool.submit(store_blob, r) for blob, r in blobs.items()}
+        manifest_futures = [pool.submit(store_manifest, r) for r in results]
+        #st elements only work from the script thread, so the bar is updated here
+        pending = list(blob_futures.values()) + manifest_futures
+        while pending:
+            done, pending = wait(pending, timeout=0.2)
+            if progress is not None:
+                progress.progress(min(sent[0] / total, 1.0))
+
+    #blobs go in with "add": if another session stored the same bytes meanwhile that is not a conflict
+    entries = []
+    blob_done = {}
+    for blob, future in blob_futures.items():
+        try:
+            cursor, seconds = future.result()
+        except Exception as e:
+            blob_done[blob] = (False, str(e), 0.0)
+            continue
+        if cursor is None:
+            blob_done[blob] = (True, None, seconds)
+        else:
+            commit = dropbox.files.CommitInfo(path=blob, mode=dropbox.files.WriteMode("add"))
+            entries.append(("blob", blob, dropbox.files.UploadSessionFinishArg(cursor, commit, content_hash=blobs[blob]["content_hash"])))
+            blob_done[blob] = (None, None, seconds)
+
+    for r, future in zip(results, manifest_futures):
+        ok, error, r["seconds"] = blob_done[r["blob"]]
+        r["deduplicated"] = ok is True
+        if ok is False:
+            r["error"] = error
+            continue
+        try:
+            commit = dropbox.files.CommitInfo(path=manifest_path(r["path"]), mode=dropbox.files.WriteMode("overwrite"))
+            entries.append(("manifest", r, dropbox.files.UploadSessionFinishArg(future.result(), commit)))
+        except Exception as e:
+            r["error"] = str(e)
+
+    if not entries:
+        return results
+
+    started = time.monotonic()
+    try:
+        batch = dbx.files_upload_session_finish_batch_v2([arg for _, _, arg in entries])
+    except dropbox.exceptions.DropboxException as e:
+        for r in results:
+            r["error"] = r["error"] or str(e)
+        return results
+    commit_seconds = time.monotonic() - started
+
+    failed_blobs = {}
+    for (kind, key, _), entry in zip(entries, batch.entries):
+        if kind == "blob" and not entry.is_success():
+            failed_blobs[key] = str(entry.get_failure())
+
+    #remember what went through (and the name it went to) so the next rerun doesn't send it again
+    sent_files = st.session_state.setdefault("soil_tests_sent", {})
+    for (kind, r, _), entry in zip(entries, batch.entries):
+        if kind != "manifest":
+            continue
+        r["seconds"] += commit_seconds
+        if r["blob"] in failed_blobs:
+            r["error"] = failed_blobs[r["blob"]]
+        elif not entry.is_success():
+            r["error"] = str(entry.get_failure())
+        else:
+            r["ok"] = True
+            sent_files[fingerprint(r["file"])] = r["path"]
+
+    return results
+
+
+def show_upload_report(results):
+    """Summary of an upload_files call, with how long each file took"""
+    uploaded = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+    if uploaded:
+        st.success(f"Uploaded {len(uploaded)} soil test file(s)")
+    for r in uploaded:
+        note = " (already stored, nothing sent)" if r["deduplicated"] else ""
+        st.caption(f"{r['name']}: {r['seconds']:.1f} s{note}")
+    for r in failed:
+        st.warning(f"Could not upload {r['name']}: {r['error']}")
@@ -0,0 +1,380 @@
+#==================================================================================================================================
+#Write-behind submission queue
+#==================================================================================================================================
+#submit handlers commit their rows to a local SQLite spool and return right away
+#one background writer per server process drains the spool to Dropbox in arrival order (see dropbox_storage.append_rows)
+#rows that arrive close together are group-committed: one read and one upload per table for the whole batch
+#rows stay in the spool until Dropbox has them, so a crash or restart doesn't lose a submission
+#a survey session can also hold its rows as a draft and queue them all at once on Finish (see draft_row / commit_draft),
+#the draft is checkpointed in the spool so an abandoned session's rows are still saved
+#a submission carries the client ID of its form instance (see submission_id), one already seen is a replay (double click,
+#rerun) and is dropped
+
+#import modules
+import os
+import json
+import sqlite3
+import threading
+import datetime
+import time
+import uuid
+from contextlib import closing
+import pandas as pd
+import streamlit as st
+from dropbox_storage import append_rows, read_csv_from_dropbox_safely, partition_columns, read_partitions
+from survey_schema import table_schema, concat_tables
+
+#local spool database (override with [storage] spool_path in secrets)
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".spool", "submissions.sqlite3")
+
+#after the first row arrives, keep collecting rows for this long (seconds) or until the batch is full
+GROUP_COMMIT_WINDOW = 0.25
+GROUP_COMMIT_MAX_ROWS = 50
+
+#a batch claimed by a writer that died is handed to another writer after this long (seconds)
+CLAIM_TIMEOUT = 300
+
+#wait between attempts while Dropbox is failing (seconds), doubled up to the max
+FLUSH_RETRY_DELAY = 1
+FLUSH_RETRY_MAX_DELAY = 60
+
+#a draft nobody has touched for this long (seconds) is taken as abandoned and its rows are queued
+DRAFT_RECOVERY_AGE = 2 * 3600
+
+#checkpoints of drafts that were queued are forgotten after this long idle (seconds)
+DRAFT_FORGET_AGE = 24 * 3600
+
+#how often the writer looks for abandoned drafts (seconds)
+DRAFT_RECOVERY_INTERVAL = 600
+
+#submission IDs are remembered this long (seconds), replays come within seconds or minutes
+RECENT_SUBMISSIONS_AGE = 24 * 3600
+
+
+class SubmissionSpool:
+    """Durable local queue of submitted rows (SQLite in WAL mode, fsync on every commit)"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS submissions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    columns TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    claimed_until REAL
+                )"""
+            )
+            #committed: how many of the draft's rows are already in submissions (recovered before Finish)
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS checkpoints (
+                    draft_id TEXT PRIMARY KEY,
+                    items TEXT NOT NULL,
+                    committed INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            #IDs of submissions already accepted, a primary key lookup tells a replay apart
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS recent_submissions (
+                    submission_id TEXT PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                )"""
+            )
+            conn.commit()
+
+    def _connect(self):
+        #a connection per call, sqlite handles the locking between threads and processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def add(self, path, row, columns, submission_id=None):
+        """Commit one row to disk, returns its spool id (None for a replayed submission_id, nothing is stored)"""
+        with closing(self._connect()) as conn, conn:
+            return self._insert(conn, path, row, columns, submission_id)
+
+    def _insert(self, conn, path, row, columns, submission_id=None):
+        #the ID is recorded in the same transaction as the row, so a replay can't slip in between
+        if submission_id is not None:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO recent_submissions (submission_id, seen_at) VALUES (?, ?)",
+                (submission_id, time.time()),
+            )
+            if cursor.rowcount == 0:
+                return None
+
+        #dates from st.date_input are stored the way to_csv would write them
+        cursor = conn.execute(
+            "INSERT INTO submissions (path, row, columns, created_at) VALUES (?, ?, ?, ?)",
+            (path, json.dumps(row, default=str), json.dumps(list(columns)), datetime.datetime.now().isoformat()),
+        )
+        return cursor.lastrowid
+
+    def checkpoint(self, draft_id, items):
+        """Save a draft's (path, row, columns, submission_id) items so they survive the session"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO checkpoints (draft_id, items, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(draft_id) DO UPDATE SET items = excluded.items, updated_at = excluded.updated_at",
+                (draft_id, json.dumps(items, default=str), time.time()),
+            )
+
+    def commit_draft(self, draft_id, items):
+        """Queue a draft's items and drop its checkpoint in one transaction, skipping items a recovery already queued"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            found = conn.execute("SELECT committed FROM checkpoints WHERE draft_id = ?", (draft_id,)).fetchone()
+            for path, row, columns, submission_id in items[found[0] if found else 0:]:
+                self._insert(conn, path, row, columns, submission_id)
+            conn.execute("DELETE FROM checkpoints WHERE draft_id = ?", (draft_id,))
+
+    def recover_drafts(self, now=None):
+        """Queue the rows of drafts idle for DRAFT_RECOVERY_AGE, returns how many rows were queued"""
+        now = time.time() if now is None else now
+        queued = 0
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stale = conn.execute(
+                "SELECT draft_id, items, committed FROM checkpoints WHERE updated_at < ?",
+                (now - DRAFT_RECOVERY_AGE,),
+            ).fetchall()
+            for draft_id, items, committed in stale:
+                items = json.loads(items)
+                for path, row, columns, submission_id in items[committed:]:
+                    self._insert(conn, path, row, columns, submission_id)
+                queued += len(items) - committed
+                #kept a while in case the respondent comes back and finishes, so their rows aren't queued twice
+                conn.execute("UPDATE checkpoints SET committed = ? WHERE draft_id = ?", (len(items), draft_id))
+            conn.execute(
+                "DELETE FROM checkpoints WHERE updated_at < ? AND committed > 0", (now - DRAFT_FORGET_AGE,)
+            )
+        return queued
+
+    def seen(self, submission_id):
+        """True if a row with this submission_id was queued within RECENT_SUBMISSIONS_AGE"""
+        with closing(self._connect()) as conn:
+            found = conn.execute("SELECT 1 FROM recent_submissions WHERE submission_id = ?", (submission_id,)).fetchone()
+        return found is not None
+
+    def forget_submissions(self, now=None):
+        """Drop submission IDs older than RECENT_SUBMISSIONS_AGE"""
+        now = time.time() if now is None else now
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM recent_submissions WHERE seen_at < ?", (now - RECENT_SUBMISSIONS_AGE,))
+
+    def claim(self, limit):
+        """Claim the oldest unclaimed rows for writing, as (id, path, row, columns) tuples"""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            #immediate transaction so two writers never claim the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, path, row, columns FROM submissions"
+                " WHERE claimed_until IS NULL OR claimed_until < ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE submissions SET claimed_until = ? WHERE id = ?",
+                [(now + CLAIM_TIMEOUT, r[0]) for r in rows],
+            )
+        return [(id_, path, json.loads(row), json.loads(columns)) for id_, path, row, columns in rows]
+
+    def release(self, ids):
+        """Give rows back after a failed write so they are retried"""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("UPDATE submissions SET claimed_until = NULL WHERE id = ?", [(i,) for i in ids])
+
+    def remove(self, ids):
+        """Drop rows that Dropbox now has"""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM submissions WHERE id = ?", [(i,) for i in ids])
+
+    def depth(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+    def pending_rows(self, path):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT row FROM submissions WHERE path = ? ORDER BY id", (path,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+
+class SubmissionWriter:
+    """Background thread that drains the spool to Dropbox"""
+
+    def __init__(self, spool):
+        self.spool = spool
+        self._wake = threading.Event()
+        self.last_flush = None #time of the last successful write
+        self.last_error = None
+        self.written = 0
+        self.batches = 0
+
+        #rows left over from before a restart are drained straight away
+        self._wake.set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, path, row, columns, submission_id=None):
+        """Commit a row for the table at path locally and return without waiting for Dropbox, False for a replay"""
+        if self.spool.add(path, row, columns, submission_id) is None:
+            return False
+        self._wake.set()
+        return True
+
+    def submit_draft(self, draft_id, items):
+        """Commit all of a draft's rows locally at once, they reach Dropbox together (one write per table)"""
+        self.spool.commit_draft(draft_id, items)
+        self._wake.set()
+
+    def depth(self):
+        """Rows accepted but not yet saved to Dropbox"""
+        return self.spool.depth()
+
+    def pending_rows(self, path):
+        return self.spool.pending_rows(path)
+
+    def _write(self, path, items):
+        """Save all spooled items for one table in a single write"""
+        rows = [row for _, _, row, _ in items]
+        #tables filled from different forms have different keys, create with all of them
+        columns = list(dict.fromkeys(c for _, _, _, cols in items for c in cols))
+        append_rows(path, rows, columns)
+
+        self.spool.remove([id_ for id_, _, _, _ in items])
+        self.written += len(rows)
+        self.batches += 1
+        self.last_flush = datetime.datetime.now()
+        self.last_error = None
+
+    def _run(self):
+        delay = FLUSH_RETRY_DELAY
+        recovered_at = 0
+        while True:
+            self._wake.wait(DRAFT_RECOVERY_INTERVAL)
+            self._wake.clear()
+            if time.time() - recovered_at >= DRAFT_RECOVERY_INTERVAL:
+                recovered_at = time.time()
+                try:
+                    self.spool.recover_drafts()
+                    self.spool.forget_submissions()
+                except sqlite3.Error as e:
+                    self.last_error = str(e)
+            #give other sessions submitting at the same moment a chance to join the batch
+            time.sleep(GROUP_COMMIT_WINDOW)
+
+            batch = self.spool.claim(GROUP_COMMIT_MAX_ROWS)
+            if not batch:
+                continue
+
+            #group by table, keeping arrival order within each table
+            by_path = {}
+            for item in batch:
+                by_path.setdefault(item[1], []).append(item)
+
+            failed = False
+            for path, items in by_path.items():
+                try:
+                    self._write(path, items)
+                except Exception as e:
+                    #rows stay in the spool and are retried
+                    self.spool.release([id_ for id_, _, _, _ in items])
+                    self.last_error = str(e)
+                    failed = True
+
+            if failed:
+                time.sleep(delay)
+                delay = min(delay * 2, FLUSH_RETRY_MAX_DELAY)
+            else:
+                delay = FLUSH_RETRY_DELAY
+            #more may be waiting (full batch, failures or rows that came in meanwhile)
+            if failed or len(batch) == GROUP_COMMIT_MAX_ROWS:
+                self._wake.set()
+
+
+@st.cache_resource(show_spinner=False)
+def get_submission_writer():
+    """One submission writer per server process"""
+    spool_path = st.secrets.get("storage", {}).get("spool_path", DEFAULT_SPOOL_PATH)
+    return SubmissionWriter(SubmissionSpool(spool_path))
+
+
+def submission_id(form, answers=None):
+    """Client ID of the form instance this session is filling in, the same on every submit of it"""
+    #made up per form instance, never from the answers, so two fields with the same answers are two submissions
+    #answers: for a form that stays on screen to be corrected, a submit with other answers than the last is a new submission
+    entered = None if answers is None else json.dumps(answers, sort_keys=True, default=str)
+    submissions = st.session_state.setdefault("submission_ids", {})
+    if form not in submissions or submissions[form][1] != entered:
+        submissions[form] = (uuid.uuid4().hex, entered)
+    return submissions[form][0]
+
+
+def submission_seen(submission_id):
+    """True if the submission is already in this session's draft or was queued, a submit handler skips it"""
+    #checked before the handler hands out IDs or field numbers, so a replay costs no Dropbox call
+    if any(item[3] == submission_id for item in draft_items()):
+        return True
+    return get_submission_writer().spool.seen(submission_id)
+
+
+def queue_row(path, row, columns, submission_id=None):
+    """Save a submitted row locally now and to Dropbox in the background, False if submission_id was already saved"""
+    return get_submission_writer().submit(path, row, columns, submission_id)
+
+
+def draft_row(path, row, columns, submission_id=None):
+    """Hold a row in this session's draft (checkpointed locally) until commit_draft queues the whole draft"""
+    #a replayed submission_id is dropped when the draft is committed
+    draft_id = st.session_state.setdefault("draft_id", uuid.uuid4().hex)
+    items = st.session_state.setdefault("draft_items", [])
+    if submission_id is not None and any(item[3] == submission_id for item in items):
+        return
+    items.append([path, row, list(columns), submission_id])
+    get_submission_writer().spool.checkpoint(draft_id, items)
+
+
+def draft_items():
+    """This session's drafted [path, row, columns, submission_id] items, rows changed here are queued as changed"""
+    return st.session_state.get("draft_items", [])
+
+
+def commit_draft():
+    """Queue every row of this session's draft in one transaction, the next draft starts empty"""
+    draft_id = st.session_state.pop("draft_id", None)
+    items = st.session_state.pop("draft_items", [])
+    if draft_id is not None:
+        get_submission_writer().submit_draft(draft_id, items)
+
+
+def read_table(path, columns, usecols=None, producer_ids=None):
+    """Table at path including rows still waiting in the spool, usecols reads only those columns"""
+    #producer_ids prunes a partitioned table to those producers' buckets, other producers may still be in the result
+    if producer_ids is not None and partition_columns(path):
+        df = read_partitions(path, columns, usecols, producer_ids=producer_ids)
+    else:
+        df = read_csv_from_dropbox_safely(path, columns, usecols)
+    pending = get_submission_writer().pending_rows(path)
+    if not pending:
+        return df
+    pending = pd.DataFrame(pending)
+    if usecols is not None:
+        pending = pending[[c for c in usecols if c in pending.columns]]
+    return concat_tables([df, pending], table_schema(path))
+
+
+def show_save_status():
+    """Small note under the forms while submissions are still being saved"""
+    writer = get_submission_writer()
+    depth = writer.depth()
+    if writer.last_error and depth:
+        st.caption(f"Saving {depth} submission(s), Dropbox is not responding, retrying: {writer.last_error}")
+    elif depth:
+        st.caption(f"Saving {depth} submission(s) in the background")
+    elif writer.last_flush is not None:
+        st.caption(f"All submissions saved (last saved {writer.last_flush:%H:%M:%S})")
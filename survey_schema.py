@@ -0,0 +1,307 @@
+#==================================================================================================================================
+#Survey table schemas
+#==================================================================================================================================
+#dtypes of the producer and field tables, taken from the answers the forms allow
+#enumerated answers (selectbox/radio) are categoricals, numbers typed into text boxes nullable numerics
+#(Int64 while every value is whole, so they are written back without a trailing .0), coordinates float32,
+#checkboxes nullable booleans and everything else Arrow-backed strings ("str" from pandas 3 on)
+#an answer that doesn't fit (a word in a number box, an option from an older form) is kept, never coerced away
+
+#import modules
+import os
+import pandas as pd
+
+#___________________________________________________________________________________________________________________________________________
+# Form options (the Survey_deploy.py and keepsafe.py forms use these, so the schema and the forms can't drift apart)
+
+YES_NO = ("yes", "no")
+NO_YES = ("no", "yes")
+SELECT_YES_NO = ("Select", "yes", "no")
+BLANK_YES_NO = ("--", "yes", "no")
+
+ED_LEVEL_OPTIONS = ("--", "below highschool", "highschool", "some college", "associates degree",
+                    "trade/vocational program", "bachelors degree", "postgraduate degree")
+FARM_PURPOSE_OPTIONS = ("--", "Grain", "Livestock", "50/50", "Other")
+QUALITY_OPTIONS = ("a", "b", "c")
+
+CROP_PURPOSE_OPTIONS = ("--", "seed", "grain", "forage", "dual-purpose", "other")
+PREV_CROP_PURPOSE_OPTIONS = ("--", "Grain", "Seed", "Forage", "Silage", "Other")
+YIELD_UNIT_OPTIONS = ("bu/ac", "lb/ac", "kg/ha", "other")
+FIELD_SIZE_UNIT_OPTIONS = ("Acres", "Hectares")
+SEED_SOURCE_OPTIONS = ("--", "Saved", "Cerified", "Registered")
+SEED_TREAT_OPTIONS = ("--", "none", "both", "funicide", "herbicide")
+SEED_RATE_UNIT_OPTIONS = ("--", "lb/ac", "plants/ac", "seeds/ac")
+TILLAGE_OPTIONS = ("--", "no-till", "minimal", "full")
+PROFILE_H20_RANK_OPTIONS = ("--", "A", "B", "C")
+
+RATE_UNIT_OPTIONS = ("lb/ac", "gal/ac", "oz/ac")
+APPLICATION_TIME_OPTIONS = ("pre-plant/at-drilling", "Fall", "Green-up/top-dress", "Late season", "Post Harvest")
+APPLIED_WITH_OPTIONS = ("None", "Herbicide", "Fertigation", "Fungicide")
+VARIABLE_RATE_OPTIONS = ("No", "Yes")
+NUTRIENT_OPTIONS = ("none", "N", "P2O5", "K2O", "S", "Lime", "Micro", "Zinc")
+NUTRIENT_SLOTS = ("a", "b", "c", "d", "e", "f")
+
+IRR_DECISION_OPTIONS = ("crop consultant", "moisture probes", "visual assessment", "consistent scheduled dates")
+IRR_TYPE_OPTIONS = ("center pivot", "drip", "flood", "other")
+WATER_SOURCE_OPTIONS = ("Ground", "Surface")
+MONTH_OPTIONS = ("--", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+EARLY_LATE_OPTIONS = ("--", "early", "late")
+
+#nutrient products and irrigation events on the field form
+NUTRIENT_PRODUCTS = range(1, 7)
+IRRIGATION_EVENTS = range(1, 9)
+
+#the older keepsafe.py forms offer some different answers, they write the same tables so the schema takes both
+KEEPSAFE_PREV_CROP_PURPOSE_OPTIONS = ("Grain", "Seed", "Forage", "Silage", "Other")
+KEEPSAFE_YIELD_UNIT_OPTIONS = ("bu/ac", "t/ha", "lb/ac", "kg/ha", "other")
+KEEPSAFE_SEED_SOURCE_OPTIONS = ("--", "Saved", "Certified", "Registered")
+KEEPSAFE_SEED_TREAT_OPTIONS = ("--", "None", "Insecticide only", "Fungicide only", "Both")
+KEEPSAFE_SEED_RATE_UNIT_OPTIONS = ("lbs/ac", "seeds/ac")
+KEEPSAFE_TILLAGE_OPTIONS = ("No-till", "Minimal", "Full")
+KEEPSAFE_APPLICATION_TIME_OPTIONS = ("pre-plant/at-drilling", "Fall", "Green-up", "Late season", "Post Harvest")
+KEEPSAFE_NUTRIENT_OPTIONS = ("N", "P", "K", "S", "Lime", "Micro")
+KEEPSAFE_MONTH_OPTIONS = MONTH_OPTIONS[1:]
+KEEPSAFE_EARLY_LATE_OPTIONS = EARLY_LATE_OPTIONS[1:]
+
+#___________________________________________________________________________________________________________________________________________
+# Schemas (column -> tuple of options for categoricals, or a dtype name)
+
+#pandas 3 string dtype, blank cells stay missing (pandas 2 would turn them into the text "nan"), hence pandas>=3 in requirements.txt
+TEXT = "str"
+NUMBER = "number" #Int64 or Float64
+COORDINATE = "float32"
+FLAG = "boolean"
+
+PRODUCER_SCHEMA = {
+    "firstname": TEXT,
+    "lastname": TEXT,
+    "phone": TEXT,
+    "email": TEXT,
+    "age": NUMBER,
+    "ed_level": ED_LEVEL_OPTIONS,
+    "producer_id": TEXT, #six digits, leading zeros matter
+    "kn_extension_agent": FLAG,
+    "kn_prv_consult": FLAG,
+    "kn_product_vendor": FLAG,
+    "kn_self": FLAG,
+    "kn_other": FLAG,
+    "irr_wheat_ac": NUMBER,
+    "farm_": NUMBER,
+    "farm_purpose": FARM_PURPOSE_OPTIONS,
+    "rotation_dry": TEXT,
+    "rotaion_irr": TEXT,
+    "rotation_irr": TEXT,
+    "years_irr": NUMBER,
+    "dry_v_irr": SELECT_YES_NO,
+    "water_limits": TEXT,
+    "limits": TEXT,
+    "quality": QUALITY_OPTIONS,
+}
+
+
+def _either(*forms):
+    """Options of a question asked differently by the two forms, in first-seen order"""
+    return tuple(dict.fromkeys(option for options in forms for option in options))
+
+
+def field_schema():
+    """Schema of the field table, one column per answer of the field form"""
+    schema = {
+        "producer_id": TEXT,
+        "field_number": NUMBER,
+        "yield": NUMBER,
+        "yield_unit": _either(YIELD_UNIT_OPTIONS, KEEPSAFE_YIELD_UNIT_OPTIONS),
+        "forage_yield": NUMBER,
+        "forage_unit": TEXT,
+        "lat": COORDINATE,
+        "long": COORDINATE,
+        "county_ident": TEXT,
+        "section": TEXT,
+        "township": TEXT,
+        "range": TEXT,
+        "field_": NUMBER,
+        "field__unit": TEXT,
+        "field_size": NUMBER,
+        "field_size_unit": FIELD_SIZE_UNIT_OPTIONS,
+        "crop_purpose": CROP_PURPOSE_OPTIONS,
+        "irr": YES_NO,
+        "prev_crop": TEXT,
+        "prev_crop_year": NUMBER,
+        "prev_crop_purpose": _either(PREV_CROP_PURPOSE_OPTIONS, KEEPSAFE_PREV_CROP_PURPOSE_OPTIONS),
+        "prev_crop_irr": _either(YES_NO, SELECT_YES_NO),
+        "planting_date": TEXT,
+        "harvest_date": TEXT,
+        "cultivar": TEXT,
+        "seed_source": _either(SEED_SOURCE_OPTIONS, KEEPSAFE_SEED_SOURCE_OPTIONS),
+        "seed_cleaned": BLANK_YES_NO,
+        "seed_treat": _either(SEED_TREAT_OPTIONS, KEEPSAFE_SEED_TREAT_OPTIONS),
+        "tillage": _either(TILLAGE_OPTIONS, KEEPSAFE_TILLAGE_OPTIONS),
+        "profile_h20": TEXT,
+        "profile_h20_rank": PROFILE_H20_RANK_OPTIONS,
+        "row_space": NUMBER,
+        "seeding_rate": NUMBER,
+        "seeding_rate_unit": _either(SEED_RATE_UNIT_OPTIONS, KEEPSAFE_SEED_RATE_UNIT_OPTIONS),
+        "seed_rate_unit": SEED_RATE_UNIT_OPTIONS,
+        "impacting_events": TEXT,
+        "K_soil": NUMBER,
+        "P_soil": NUMBER,
+        "N_soil": NUMBER,
+        "N_soildepth": TEXT,
+        "manure": YES_NO,
+        "manure_rate": TEXT,
+        "manure_freq": TEXT,
+        "fung": SELECT_YES_NO,
+        "fungicide_freq": TEXT,
+        "fungicide_time": TEXT,
+        "fungicide_prod": TEXT,
+        "herb": SELECT_YES_NO,
+        "herbicide_freq": TEXT,
+        "herbicide_time": TEXT,
+        "herb_prod": TEXT,
+        "insect": SELECT_YES_NO,
+        "insecticide_freq": TEXT,
+        "insecticide_time": TEXT,
+        "insect_prod": TEXT,
+        "irrigated": SELECT_YES_NO,
+        "irr_shared": TEXT,
+        "irr_decision": IRR_DECISION_OPTIONS,
+        "irr_type": IRR_TYPE_OPTIONS,
+        "system_config": NUMBER,
+        "system_height": NUMBER,
+        "system_details": TEXT,
+        "system_capacity": NUMBER,
+        "water_source": WATER_SOURCE_OPTIONS,
+        "capacity_flux": TEXT,
+        "pre_plant_water": SELECT_YES_NO,
+    }
+
+    # nutrient products
+    for i in NUTRIENT_PRODUCTS:
+        schema[f"{i}_product"] = TEXT
+        schema[f"{i}_rate"] = NUMBER
+        schema[f"{i}_rate_unit"] = RATE_UNIT_OPTIONS
+        schema[f"{i}_time"] = _either(APPLICATION_TIME_OPTIONS, KEEPSAFE_APPLICATION_TIME_OPTIONS)
+        schema[f"{i}_date"] = TEXT
+        schema[f"{i}_month"] = TEXT
+        schema[f"{i}_plus"] = APPLIED_WITH_OPTIONS
+        schema[f"{i}_vr"] = VARIABLE_RATE_OPTIONS
+        for n in NUTRIENT_SLOTS:
+            schema[f"{i}_nutrient_{n}"] = _either(NUTRIENT_OPTIONS, KEEPSAFE_NUTRIENT_OPTIONS)
+            schema[f"{i}_nutrient_{n}_amnt"] = NUMBER
+
+    # irrigation events
+    for i in IRRIGATION_EVENTS:
+        schema[f"irr{i}_date"] = TEXT
+        schema[f"irr{i}_month"] = MONTH_OPTIONS
+        schema[f"irr{i}_timing"] = EARLY_LATE_OPTIONS
+        schema[f"irr{i}_amount"] = NUMBER
+        schema[f"irr{i}_rate"] = NUMBER
+        schema[f"irr{i}_fertigation"] = _either(NO_YES, SELECT_YES_NO)
+
+    return schema
+
+
+FIELD_SCHEMA = field_schema()
+
+#tables by file name, so every copy of a table (csv, records, snapshots) gets the same dtypes
+TABLE_SCHEMAS = {
+    "producers_info": PRODUCER_SCHEMA,
+    "fields_info": FIELD_SCHEMA,
+}
+
+
+def table_schema(path):
+    """Schema of the table stored at path (/streamlit/fields_info.csv or .csv.gz or .parquet -> FIELD_SCHEMA), None for other files"""
+    return TABLE_SCHEMAS.get(os.path.basename(path).split(".", 1)[0])
+
+
+#___________________________________________________________________________________________________________________________________________
+# Applying a schema
+
+def read_csv_options(schema):
+    """Keyword arguments for pd.read_csv: categoricals and text are typed while parsing, numbers are checked afterwards"""
+    if schema is None:
+        return {}
+    dtypes = {}
+    for column, spec in schema.items():
+        if isinstance(spec, tuple):
+            dtypes[column] = "category"
+        elif spec == TEXT:
+            dtypes[column] = TEXT
+    #only blank cells are missing, "None" and "NA" are answers ("None" is an option of the nutrient form)
+    return {"dtype": dtypes, "keep_default_na": False, "na_values": [""]}
+
+
+def _answered(s):
+    return s.notna() & (s.astype(TEXT).str.strip() != "")
+
+
+def _as_category(s, options):
+    #form options first, then anything else that was saved ("other" answers, options of older forms)
+    s = s.where(_answered(s)).astype("category") if s.dtype != "category" else s
+    if tuple(s.cat.categories[:len(options)]) == options:
+        return s
+    extra = [c for c in s.cat.categories if c not in options]
+    return s.cat.set_categories(list(options) + extra)
+
+
+def _as_number(s, spec):
+    if s.dtype.kind not in "biuf":
+        #through text, so a float32 that was concatenated into an object column keeps the digits it was typed with
+        text = s.astype(TEXT)
+        answered = _answered(text)
+        numbers = pd.to_numeric(text.where(answered), errors="coerce")
+        #some answer isn't a number, keep the column as typed
+        if (numbers.notna() != answered).any():
+            return text
+        s = numbers
+
+    s = s.astype("float64")
+    values = s.dropna()
+    #float32 only if every value is written back to the csv exactly as it was typed
+    if spec == COORDINATE and (values.astype(COORDINATE).astype(TEXT) == values.astype(TEXT)).all():
+        return s.astype(COORDINATE)
+    if (values % 1 == 0).all():
+        return s.astype("Int64")
+    return s.astype("Float64")
+
+
+def _as_flag(s):
+    flags = s.map({True: True, False: False, "True": True, "False": False})
+    if (flags.isna() & s.notna()).any():
+        return s.astype(TEXT)
+    return flags.astype(FLAG)
+
+
+#dtypes a numeric column can already have once it went through _as_number
+_NUMBER_DTYPES = {NUMBER: ("Int64", "Float64"), COORDINATE: (COORDINATE, "Int64", "Float64")}
+
+
+def apply_schema(df, schema):
+    """Give the columns of df their schema dtypes (columns the schema doesn't know keep theirs)"""
+    if df is None or schema is None:
+        return df
+    for column in df.columns.intersection(list(schema)):
+        spec = schema[column]
+        s = df[column]
+        if isinstance(spec, tuple):
+            df[column] = _as_category(s, spec)
+        elif spec == TEXT:
+            df[column] = s if s.dtype == TEXT else s.astype(TEXT)
+        elif spec == FLAG:
+            df[column] = s if s.dtype == FLAG else _as_flag(s)
+        else:
+            df[column] = s if str(s.dtype) in _NUMBER_DTYPES[spec] else _as_number(s, spec)
+    return df
+
+
+def concat_tables(frames, schema):
+    """pd.concat for pieces of one table (stored rows, new rows, records), typed by schema"""
+    dtypes = {}
+    for df in frames:
+        for column, dtype in df.dtypes.items():
+            dtypes.setdefault(column, set()).add(str(dtype))
+    #float32 mixed into an object column is written with float64 digits (39.08039 -> 39.08039093017578), go through text
+    mixed = {column: TEXT for column, d in dtypes.items() if COORDINATE in d and len(d) > 1}
+    frames = [df.astype({c: t for c, t in mixed.items() if c in df.columns}) for df in frames]
+    return apply_schema(pd.concat(frames, ignore_index=True), schema)